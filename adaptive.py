@@ -0,0 +1,71 @@
+import os
+from datetime import datetime
+
+# Adaptive polling. For sites with "adaptive" set, the time between changes is
+# tracked as an exponentially weighted moving average, and the site is checked
+# about ADAPTIVE_CHECKS_PER_CHANGE times per expected change. A quiet period
+# longer than the average counts as the current estimate, so quiet sites back
+# off toward ADAPTIVE_MAX_INTERVAL and busy ones tighten toward ADAPTIVE_MIN_INTERVAL.
+# The configured interval is the starting point.
+ADAPTIVE_MIN_INTERVAL = int(os.getenv("ADAPTIVE_MIN_INTERVAL", "30"))
+ADAPTIVE_MAX_INTERVAL = int(os.getenv("ADAPTIVE_MAX_INTERVAL", "3600"))
+ADAPTIVE_CHECKS_PER_CHANGE = float(os.getenv("ADAPTIVE_CHECKS_PER_CHANGE", "4"))
+# Weight of the newest gap between changes in the average
+ADAPTIVE_SMOOTHING = float(os.getenv("ADAPTIVE_SMOOTHING", "0.3"))
+# The interval grows by at most this factor per check; it shrinks right away
+ADAPTIVE_MAX_GROWTH = 1.5
+
+# Failure backoff. A failing site is checked again after FAILURE_BACKOFF_BASE
+# seconds, twice as long after every further failure in a row, up to
+# FAILURE_BACKOFF_MAX seconds. It is never checked more often than its own
+# interval. Any successful check returns it to its interval.
+FAILURE_BACKOFF_BASE = float(os.getenv("FAILURE_BACKOFF_BASE", "60"))
+FAILURE_BACKOFF_MAX = float(os.getenv("FAILURE_BACKOFF_MAX", "3600"))
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Interval the site is checked at right now
+def site_interval(site):
+    if site.get("adaptive") and site.get("effective_interval"):
+        return site["effective_interval"]
+    return site["interval"]
+
+# Seconds from a check to the next one: the interval, or the backoff of a failing site
+def next_check_interval(site):
+    failures = site.get("consecutive_failures") or 0
+    if not failures:
+        return site_interval(site)
+    return max(site_interval(site), min(FAILURE_BACKOFF_BASE * 2 ** min(failures - 1, 32), FAILURE_BACKOFF_MAX))
+
+# Whether a failing site is still within the backoff after its last failed check
+def backing_off(site, now=None):
+    if not site.get("consecutive_failures") or not site.get("last_failed"):
+        return False
+    now = now or datetime.now()
+    failed = datetime.strptime(site["last_failed"], TIME_FORMAT)
+    return (now - failed).total_seconds() < next_check_interval(site)
+
+# Learn from a successful check. previous_change is the site's last_changed
+# from before the check.
+def update_adaptive_interval(site, changed, previous_change, checked_at):
+    if not site.get("adaptive"):
+        return
+    now = datetime.strptime(checked_at, TIME_FORMAT)
+    if site.get("observed_since") is None:
+        site["observed_since"] = checked_at
+    observed_since = datetime.strptime(site["observed_since"], TIME_FORMAT)
+
+    # Time since the previous change, or since the site is observed
+    since = datetime.strptime(previous_change, TIME_FORMAT) if previous_change else observed_since
+    quiet = (now - since).total_seconds()
+
+    mean_gap = site.get("mean_change_gap") or site["interval"] * ADAPTIVE_CHECKS_PER_CHANGE
+    if changed:
+        mean_gap = ADAPTIVE_SMOOTHING * quiet + (1 - ADAPTIVE_SMOOTHING) * mean_gap
+        quiet = 0
+
+    interval = max(mean_gap, quiet) / ADAPTIVE_CHECKS_PER_CHANGE
+    interval = min(interval, site_interval(site) * ADAPTIVE_MAX_GROWTH)
+    interval = max(ADAPTIVE_MIN_INTERVAL, min(ADAPTIVE_MAX_INTERVAL, interval))
+    site["mean_change_gap"] = mean_gap
+    site["effective_interval"] = int(round(interval))
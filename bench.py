@@ -0,0 +1,354 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Benchmark of the check pipeline against a local server of synthetic sites:
+#   python -m bench                                 default mix, results in bench-results.json
+#   python -m bench --sites 500 --rounds 5          more load
+#   python -m bench --compare bench-results.json    fail when slower than an earlier run
+# The server runs in its own process, so its work doesn't count against the
+# checks. Every run uses a fresh store, snapshot archive and history in a
+# temporary directory, and never sends notifications.
+
+# Kinds of synthetic sites and their default share of the sites
+SITE_KINDS = ("static", "changing", "large", "slow", "listing")
+DEFAULT_MIX = "static=40,changing=20,large=10,slow=10,listing=20"
+
+# Room counts of the listing pages timed for parse cost
+PARSE_ROOM_COUNTS = (10, 100, 1000)
+
+FILLER = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+          "incididunt ut labore et dolore magna aliqua. ")
+
+
+# Pages of the synthetic sites. The kind is the first path segment, e.g.
+# /changing/7. Listing pages live below /stwdo.de/ because the room
+# detection only applies to STWDO URLs.
+def _filler(kb, seed):
+    paragraph = f"<p>{seed}: {FILLER * 4}</p>\n"
+    return paragraph * max(1, kb * 1024 // len(paragraph))
+
+def _page(title, body):
+    return f"<!DOCTYPE html><html><head><title>{title}</title></head><body><h1>{title}</h1>\n{body}</body></html>"
+
+def listing_page(rooms, first_room=0):
+    items = "".join(
+        f"<div class='wohnung-item'><h3>Zimmer {number} im Wohnheim {number % 17}</h3>"
+        f"<p>{10 + number % 20} m², Miete {250 + number % 150} € warm, frei ab sofort</p>"
+        f"<a href='/angebot/{number}'>Details</a></div>\n"
+        for number in range(first_room, first_room + rooms)
+    )
+    return _page("Wohnangebote", items)
+
+
+class _SyntheticHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        config = self.server.config
+        path = urlparse(self.path).path
+        kind = path.strip("/").split("/")[0]
+        with self.server.lock:
+            count = self.server.requests.get(path, 0)
+            self.server.requests[path] = count + 1
+        version = count // config["change_every"]
+
+        if kind == "static":
+            # Static pages answer revalidation with 304, like most real sites do
+            etag = f'"{zlib.crc32(path.encode()):x}"'
+            if self.headers.get("If-None-Match") == etag:
+                self._respond(304, b"", {"ETag": etag})
+                return
+            body = _page(path, _filler(config["page_kb"], path))
+            self._respond(200, body.encode(), {"ETag": etag})
+        elif kind == "changing":
+            body = _page(path, f"<p>Version {version}</p>\n" + _filler(config["page_kb"], path))
+            self._respond(200, body.encode())
+        elif kind == "large":
+            body = _page(path, f"<p>Version {version}</p>\n" + _filler(config["large_kb"], path))
+            self._respond(200, body.encode())
+        elif kind == "slow":
+            time.sleep(config["slow_ms"] / 1000)
+            self._respond(200, _page(path, _filler(config["page_kb"], path)).encode())
+        elif kind == "stwdo.de":
+            # One room is replaced by a new one with every change
+            self._respond(200, listing_page(config["rooms"], version).encode())
+        else:
+            self._respond(404, b"Not found")
+
+    def _respond(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _serve(config, port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SyntheticHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.lock = threading.Lock()
+    server.requests = {}
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+# Start the synthetic server in a child process. Returns the process and its port.
+def start_server(config):
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue()
+    process = context.Process(target=_serve, args=(config, port_queue), name="bench-server", daemon=True)
+    process.start()
+    return process, port_queue.get(timeout=30)
+
+
+def _parse_mix(mix, sites):
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in SITE_KINDS:
+            raise ValueError(f"Unknown site kind {kind!r}, expected one of {', '.join(SITE_KINDS)}")
+        weights[kind] = float(weight or 1)
+    total = sum(weights.values())
+    counts = {kind: int(sites * weight / total) for kind, weight in weights.items()}
+    # Hand out what rounding left over to the largest shares
+    for kind in sorted(weights, key=weights.get, reverse=True)[:sites - sum(counts.values())]:
+        counts[kind] += 1
+    return counts
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _latency_summary(seconds):
+    return {
+        "count": len(seconds),
+        "mean_ms": 1000 * statistics.fmean(seconds) if seconds else None,
+        "p50_ms": 1000 * _percentile(seconds, 0.5) if seconds else None,
+        "p90_ms": 1000 * _percentile(seconds, 0.9) if seconds else None,
+        "p99_ms": 1000 * _percentile(seconds, 0.99) if seconds else None,
+        "max_ms": 1000 * max(seconds) if seconds else None,
+    }
+
+# Peak resident set size of this process, in MB. None where it can't be measured.
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# One sweep, like monitor.sweep, with each check timed on its own
+def _sweep_round(max_workers):
+    import store
+    from checker import dispatch_check, run_check
+
+    def timed_check(site, throttle_wait=None):
+        started = time.perf_counter()
+        result = run_check(site, throttle_wait, enable_email=False, enable_telegram=False)
+        return result, time.perf_counter() - started
+
+    started = time.perf_counter()
+    sites = [site for site in store.read_websites(with_listings=True) if site.get("active")]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(sites))) as executor:
+        futures = [dispatch_check(executor, site["url"], partial(timed_check, site)) for site in sites]
+        checks = [future.result() for future in futures]
+    results = [result for result, _ in checks]
+    persist_started = time.perf_counter()
+    store.update_websites(sites, results)
+    finished = time.perf_counter()
+    return {
+        "seconds": finished - started,
+        "persist_seconds": finished - persist_started,
+        "latencies": [seconds for _, seconds in checks],
+        "statuses": [result["status"] for result in results],
+    }
+
+# Extraction cost of listing pages of several sizes, without the room cache
+def _parse_benchmark(repeat):
+    from checker import detect_new_rooms
+    from extractor import PARSER
+
+    rows = []
+    for rooms in PARSE_ROOM_COUNTS:
+        content = listing_page(rooms)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            _, current_rooms = detect_new_rooms(content, set())
+            timings.append(time.perf_counter() - started)
+        kb = len(content.encode()) / 1024
+        seconds = statistics.median(timings)
+        rows.append({
+            "rooms": rooms,
+            "found": len(current_rooms),
+            "page_kb": round(kb, 1),
+            "parse_ms": 1000 * seconds,
+            "parse_ms_per_kb": 1000 * seconds / kb,
+        })
+    return {"parser": PARSER or "fallback", "pages": rows}
+
+def run_benchmark(args):
+    counts = _parse_mix(args.mix, args.sites)
+    config = {
+        "page_kb": args.page_kb,
+        "large_kb": args.large_kb,
+        "slow_ms": args.slow_ms,
+        "rooms": args.rooms,
+        "change_every": args.change_every,
+    }
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    # All synthetic sites share one host, so the politeness limits are lifted,
+    # and everything the checks write goes to the temporary directory
+    os.environ.update({
+        "STORE_PATH": os.path.join(workdir, "websites.db"),
+        "SNAPSHOT_PATH": os.path.join(workdir, "snapshots.db"),
+        "HISTORY_FILE": os.path.join(workdir, "monitoring_history.jsonl"),
+        "HOST_RATE_LIMIT": "0",
+        "MAX_CHECKS_PER_HOST": str(args.concurrency),
+        "HTTP_POOL_MAXSIZE": str(args.concurrency),
+    })
+    import monitor
+    import store
+    from metrics import registry
+    from snapshots import CODEC
+    from streaming import HASH_NAME
+
+    server, port = start_server(config)
+    try:
+        number = 0
+        for kind in SITE_KINDS:
+            for _ in range(counts.get(kind, 0)):
+                if kind == "listing":
+                    url, monitor_type = f"http://127.0.0.1:{port}/stwdo.de/{number}", "stwdo_rooms"
+                else:
+                    url, monitor_type = f"http://127.0.0.1:{port}/{kind}/{number}", "any_change"
+                store.upsert_website(monitor.new_website(url, f"{kind} {number}", 60, True, monitor_type))
+                number += 1
+
+        rounds = []
+        steady_latencies = []
+        for index in range(args.rounds):
+            outcome = _sweep_round(args.concurrency)
+            statuses = outcome["statuses"]
+            rounds.append({
+                "round": index + 1,
+                "seconds": outcome["seconds"],
+                "checks_per_sec": len(statuses) / outcome["seconds"],
+                "persist_ms": 1000 * outcome["persist_seconds"],
+                "changed": statuses.count("changed"),
+                "unchanged": statuses.count("unchanged"),
+                "errors": statuses.count("error"),
+                "latency": _latency_summary(outcome["latencies"]),
+            })
+            # The first round only takes the baselines
+            if index > 0 or args.rounds == 1:
+                steady_latencies.extend(outcome["latencies"])
+            print(f"Round {index + 1}: {rounds[-1]['checks_per_sec']:.1f} checks/sec, "
+                  f"{rounds[-1]['errors']} errors", file=sys.stderr)
+    finally:
+        server.terminate()
+        server.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    steady = rounds[1:] or rounds
+    return {
+        "started_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": dict(config, sites=counts, rounds=args.rounds, concurrency=args.concurrency),
+        "environment": {"hash_algorithm": HASH_NAME, "snapshot_codec": CODEC},
+        "checks_per_sec": len(steady_latencies) / sum(round_["seconds"] for round_ in steady),
+        "latency": _latency_summary(steady_latencies),
+        "rounds": rounds,
+        "phases": registry.summary(),
+        "parse": _parse_benchmark(args.parse_repeat),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# Headline numbers, and whether a larger value is better
+def _headlines(report):
+    parse = report["parse"]["pages"]
+    return {
+        "checks_per_sec": (report["checks_per_sec"], True),
+        "latency_p50_ms": (report["latency"]["p50_ms"], False),
+        "latency_p99_ms": (report["latency"]["p99_ms"], False),
+        "peak_rss_mb": (report["peak_rss_mb"], False),
+        "parse_ms_per_kb": (statistics.fmean(row["parse_ms_per_kb"] for row in parse), False),
+    }
+
+# Print how a run compares to an earlier one. Returns the regressed headlines.
+def compare_reports(report, baseline, tolerance):
+    regressions = []
+    previous = _headlines(baseline)
+    for name, (value, higher_is_better) in _headlines(report).items():
+        before = previous.get(name, (None, None))[0]
+        if value is None or not before:
+            continue
+        change = (value - before) / before
+        worse = -change if higher_is_better else change
+        marker = "REGRESSION" if worse > tolerance else ""
+        print(f"{name:>16}: {before:10.2f} -> {value:10.2f} ({change:+.1%}) {marker}", file=sys.stderr)
+        if marker:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark the website checks against synthetic sites")
+    parser.add_argument("--sites", type=int, default=200, help="number of synthetic sites")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"share of each kind of site (default: {DEFAULT_MIX})")
+    parser.add_argument("--rounds", type=int, default=3, help="sweeps over all sites; the first takes the baselines")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent checks")
+    parser.add_argument("--page-kb", type=int, default=32, help="size of the static, changing and slow pages")
+    parser.add_argument("--large-kb", type=int, default=1024, help="size of the large pages")
+    parser.add_argument("--slow-ms", type=int, default=500, help="response delay of the slow sites")
+    parser.add_argument("--rooms", type=int, default=50, help="rooms on a listing page")
+    parser.add_argument("--change-every", type=int, default=2, help="changing sites change every N requests")
+    parser.add_argument("--parse-repeat", type=int, default=5, help="timed extractions per listing page size")
+    parser.add_argument("--output", default="bench-results.json", help="where to write the JSON report")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown before --compare fails")
+    args = parser.parse_args(argv)
+
+    # Read before the run, --output may overwrite it
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    report = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({name: value for name, (value, _) in _headlines(report).items()}))
+
+    if baseline is not None and compare_reports(report, baseline, args.tolerance):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,547 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from functools import partial
+from urllib.parse import urlparse
+
+from adaptive import update_adaptive_interval
+from extractor import cached_rooms, extract_stwdo_rooms, extract_stwdo_rooms_cached, listing_number
+from fingerprint import CHANGE_LOCALIZATION, Fingerprinter, describe_changes
+from history import append_history
+from metrics import current_check, finish_check, start_check
+from notifier import notify
+from scope import read_scoped_content
+from snapshots import SNAPSHOTS_ENABLED, SnapshotBuffer, save_snapshot
+from streaming import HASH_NAME, hash_response, hash_text
+from sessions import get_session
+
+# Concurrency limits for bulk checks
+MAX_CONCURRENT_CHECKS = int(os.getenv("MAX_CONCURRENT_CHECKS", "16"))
+MAX_CHECKS_PER_HOST = int(os.getenv("MAX_CHECKS_PER_HOST", "4"))
+# Seconds to wait for a connection, and for each read once connected, so an
+# unreachable host fails faster than a slow one
+CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("READ_TIMEOUT", "10"))
+
+# Per-host politeness: requests to one host are spread to HOST_RATE_LIMIT per
+# second on average, with bursts of up to HOST_BURST (0 disables the limit)
+HOST_RATE_LIMIT = float(os.getenv("HOST_RATE_LIMIT", "1"))
+HOST_BURST = float(os.getenv("HOST_BURST", "4"))
+# How long a host is left alone after a 429 without a usable Retry-After header
+DEFAULT_RETRY_AFTER = float(os.getenv("DEFAULT_RETRY_AFTER", "60"))
+# Per-host circuit breaker: after CIRCUIT_FAILURE_THRESHOLD checks in a row that
+# couldn't reach a host, it isn't requested for CIRCUIT_RESET_SECONDS. Then one
+# probe request decides whether it is used again or left alone for another period.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "300"))
+
+
+# Raised instead of requesting a host that asked us to back off
+class RateLimitedError(Exception):
+    pass
+
+
+# Token bucket of one host. Tokens are reserved ahead, so concurrent callers
+# queue up behind each other instead of all waking at the same moment.
+class _TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    # Take a token and return how many seconds to wait before using it
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._raise_if_blocked(now)
+            if self.rate <= 0:
+                return 0
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0, -self._tokens / self.rate)
+
+    def raise_if_blocked(self):
+        with self._lock:
+            self._raise_if_blocked(time.monotonic())
+
+    def _raise_if_blocked(self, now):
+        if now < self._blocked_until:
+            raise RateLimitedError(f"Host asked to back off for another {self._blocked_until - now:.0f} seconds")
+
+    # Stop requesting the host for the given number of seconds
+    def block(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+# Raised instead of requesting a host that keeps failing
+class CircuitOpenError(Exception):
+    pass
+
+
+class _CircuitBreaker:
+    def __init__(self):
+        self._failures = 0
+        self._open_until = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    # Raise CircuitOpenError unless the host may be requested now. Once the
+    # circuit has been open long enough, a single caller is let through as probe.
+    def allow(self):
+        with self._lock:
+            if self._failures < CIRCUIT_FAILURE_THRESHOLD:
+                return
+            now = time.monotonic()
+            if now < self._open_until or self._probing:
+                raise CircuitOpenError(f"Host unreachable {self._failures} times in a row, "
+                                       f"not requested for another {max(0, self._open_until - now):.0f} seconds")
+            self._probing = True
+
+    # The host answered
+    def succeeded(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+
+    # The host wasn't requested after all. A probe lets the next caller try instead.
+    def skipped(self):
+        with self._lock:
+            self._probing = False
+
+    # The host couldn't be reached
+    def failed(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= CIRCUIT_FAILURE_THRESHOLD:
+                self._open_until = time.monotonic() + CIRCUIT_RESET_SECONDS
+
+# Errors that mean the host couldn't be reached or stopped answering
+def _host_failure(error):
+    from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+    return isinstance(error, (ConnectionError, Timeout, ChunkedEncodingError))
+
+# Seconds to wait according to a Retry-After header (delay or HTTP date)
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.now().astimezone()).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# Detect new rooms on STWDO website. seen_listings holds the numeric IDs of every
+# listing seen before, so a listing that drops off and comes back isn't new.
+# With a content hash, pages parsed before are not parsed again.
+def detect_new_rooms(current_content, seen_listings, content_hash=None):
+    if content_hash is None:
+        current_rooms = extract_stwdo_rooms(current_content)
+    else:
+        current_rooms = extract_stwdo_rooms_cached(current_content, content_hash)
+
+    # Find new rooms (in current but never seen before)
+    new_rooms = []
+    for room in current_rooms:
+        if listing_number(room["id"]) not in seen_listings:
+            new_rooms.append(room)
+
+    return new_rooms, current_rooms
+
+# Build conditional request headers from the validators cached on the site record
+def conditional_headers(site):
+    # Without a baseline there is nothing to compare against, so fetch the full page
+    if site.get("monitor_type") == "stwdo_rooms" and "stwdo.de" in site["url"]:
+        has_baseline = site.get("first_scan_completed", False)
+    else:
+        has_baseline = site.get("current_hash") is not None
+    if not has_baseline:
+        return {}
+
+    headers = {}
+    if site.get("etag"):
+        headers["If-None-Match"] = site["etag"]
+    if site.get("last_modified"):
+        headers["If-Modified-Since"] = site["last_modified"]
+    return headers
+
+# Fetch a website, honouring the SSL setting and cached validators
+def fetch_page(site, skip_ssl_verification=False, stream=False):
+    session = get_session(verify=not skip_ssl_verification)
+    return session.get(site["url"], headers=conditional_headers(site), timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=stream)
+
+# Keep a copy of the checked content in the snapshot archive. A failing archive
+# never fails the check. Returns the snapshot version, if one was stored.
+def _archive(site, data):
+    if not SNAPSHOTS_ENABLED or data is None:
+        return None
+    try:
+        with current_check().phase("persist"):
+            return save_snapshot(site["id"], data, site["last_checked"])
+    except Exception as e:
+        print(f"Snapshot error for {site['url']}: {e}")
+        return None
+
+# Replace the site's chunk fingerprint with one of the buffered body and return
+# the byte ranges that changed. A body too large to buffer has no fingerprint.
+def _localize_changes(site, data):
+    if data is None:
+        site["fingerprint"] = None
+        return []
+    with current_check().phase("extract"):
+        fingerprinter = Fingerprinter(site.get("fingerprint"))
+        fingerprinter.update(data)
+        site["fingerprint"] = fingerprinter.finish()
+    return fingerprinter.changes
+
+# Check a single website and update its record in place.
+# Returns a change entry when a change was detected, otherwise None.
+def check_site(site, skip_ssl_verification=False, enable_email=True, enable_telegram=True):
+    timer = current_check()
+    with timer.phase("ttfb"):
+        response = fetch_page(site, skip_ssl_verification, stream=True)
+    timer.status_code = response.status_code
+
+    # Update last checked time
+    site["last_checked"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # 304 Not Modified: the page is unchanged, skip decoding, hashing and parsing
+    if response.status_code == 304:
+        response.close()
+        return None
+
+    # Throttled: leave the host alone for as long as it asks
+    retry_after = retry_after_seconds(response)
+    if response.status_code == 429 or (response.status_code == 503 and retry_after is not None):
+        response.close()
+        delay = DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+        _host_bucket(site["url"]).block(delay)
+        raise RateLimitedError(f"HTTP {response.status_code}, backing off from the host for {delay:.0f} seconds")
+
+    # The validators are only kept once the body was processed. A body that broke
+    # off or was too large would otherwise be answered with 304 from now on.
+    validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+    change = _check_content(site, response, enable_email, enable_telegram)
+    site.update(validators)
+    return change
+
+# Compare the body of a successful response with the site record and notify on changes.
+# Bodies are streamed: reading stops early for selector regions, and plain pages
+# are hashed chunk by chunk without being decoded.
+def _check_content(site, response, enable_email, enable_telegram):
+    selector = site.get("selector")
+    timer = current_check()
+    site_name = site.get('name', site['url'])
+    if site.get("monitor_type") == "stwdo_rooms" and "stwdo.de" in site["url"]:
+        # Special handling for STWDO room detection
+        content = read_scoped_content(response, selector)
+        seen_listings = site.setdefault("seen_listings", set())
+        first_scan = not site.get("first_scan_completed", False)
+
+        # Identical page bytes can't hold new rooms. Their rooms are taken from
+        # the cache to keep the seen index fresh, or the page is skipped unparsed.
+        with timer.phase("hash"):
+            content_hash = hash_text(content)
+        unchanged = (not first_scan and site.get("current_hash") == content_hash
+                     and site.get("hash_algorithm") == HASH_NAME)
+        if unchanged:
+            rooms = cached_rooms(content_hash)
+            if rooms is not None:
+                site["previous_rooms"] = rooms
+            else:
+                # Not parsed in this process: the stored rooms are still on the page
+                site["rooms_unchanged"] = True
+            return None
+
+        with timer.phase("extract"):
+            new_rooms, current_rooms = detect_new_rooms(content, seen_listings, content_hash)
+
+        # Always update the rooms list and the seen index. The hash is stored only
+        # now, so a page that failed to parse is parsed again on the next check.
+        site["current_hash"] = content_hash
+        site["hash_algorithm"] = HASH_NAME
+        site["previous_rooms"] = current_rooms
+        seen_listings.update(listing_number(room["id"]) for room in current_rooms)
+        site["first_scan_completed"] = True
+
+        if first_scan or new_rooms:
+            _archive(site, content.encode())
+        if first_scan or not new_rooms:
+            return None
+
+        # New rooms detected (not the first scan)
+        site["last_changed"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        message = f"New rooms detected on {site_name}!\n\nNew listings found: {len(new_rooms)}"
+        change = {"site": site, "new_rooms": new_rooms}
+    else:
+        # Regular change detection. The body is buffered for the snapshot archive
+        # and for the chunk fingerprint, which tells which parts of the page changed.
+        # It is only read back, and chunked, when the hash differs: chunking is far
+        # slower than hashing, and most checks find the page unchanged.
+        body = SnapshotBuffer() if SNAPSHOTS_ENABLED or CHANGE_LOCALIZATION else None
+        consumers = [body.update] if body else []
+        if selector:
+            region = read_scoped_content(response, selector)
+            with timer.phase("hash"):
+                current_hash = hash_text(region)
+                for consume in consumers:
+                    consume(region.encode())
+        else:
+            current_hash = hash_response(response, consumers)
+
+        # A hash from another algorithm can't be compared, so it is replaced as a new baseline
+        baseline = site.get("current_hash") is None or site.get("hash_algorithm") != HASH_NAME
+        changed = not baseline and current_hash != site["current_hash"]
+        localize = CHANGE_LOCALIZATION and (baseline or changed or site.get("fingerprint") is None)
+        data = None
+        if body:
+            if baseline or changed or localize:
+                data = body.data
+            body.close()
+
+        changed_regions = _localize_changes(site, data) if localize else []
+        if baseline:
+            site["current_hash"] = current_hash
+            site["hash_algorithm"] = HASH_NAME
+            _archive(site, data)
+            return None
+        if not changed:
+            return None
+
+        # Change detected
+        site["last_changed"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        site["current_hash"] = current_hash
+        message = f"Change detected on {site_name}!"
+        if changed_regions:
+            message += f"\n\nChanged regions:\n{describe_changes(changed_regions)}"
+        change = {"site": site, "changed_regions": changed_regions}
+        if SNAPSHOTS_ENABLED:
+            change["snapshot_version"] = _archive(site, data)
+
+    # Queue notifications, delivery happens on the outbox worker threads
+    with timer.phase("notify"):
+        notify(site["url"], site_name, message, enable_email=enable_email, enable_telegram=enable_telegram)
+    return change
+
+# Per-host semaphores so one host never gets more than MAX_CHECKS_PER_HOST requests
+# at once, token buckets limiting the request rate per host and circuit breakers
+_host_slots = {}
+_host_buckets = {}
+_host_circuits = {}
+_host_slots_lock = threading.Lock()
+
+def _host_key(url):
+    return urlparse(url).hostname or url
+
+def _host_slot(url):
+    host = _host_key(url)
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(MAX_CHECKS_PER_HOST)
+        return _host_slots[host]
+
+def _host_bucket(url):
+    host = _host_key(url)
+    with _host_slots_lock:
+        if host not in _host_buckets:
+            _host_buckets[host] = _TokenBucket(HOST_RATE_LIMIT, HOST_BURST)
+        return _host_buckets[host]
+
+def _host_circuit(url):
+    host = _host_key(url)
+    with _host_slots_lock:
+        if host not in _host_circuits:
+            _host_circuits[host] = _CircuitBreaker()
+        return _host_circuits[host]
+
+# Give back a host slot and let the next dispatched check of the host have it
+def _release_host_slot(url):
+    _host_slot(url).release()
+    _dispatcher.fill(_host_key(url))
+
+
+# Per-host dispatch queues. Checks wait for a host slot and a rate-limit token
+# here and are handed to the executor only once both are available, so a
+# throttled host never ties up pool threads that checks of other hosts could use.
+class _HostDispatcher:
+    def __init__(self):
+        self._queues = {}   # host -> checks waiting for a slot
+        self._delayed = []  # Heap of (start time, sequence, check) waiting for their token
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()  # Reentrant, fill() may run again from _start()
+        self._thread = None
+
+    def submit(self, executor, url, fn):
+        check = {"executor": executor, "url": url, "fn": fn, "future": Future()}
+        host = _host_key(url)
+        with self._condition:
+            self._queues.setdefault(host, deque()).append(check)
+        self.fill(host)
+        return check["future"]
+
+    # Start waiting checks of a host for as long as it has free slots
+    def fill(self, host):
+        with self._condition:
+            queue = self._queues.get(host)
+            while queue and _host_slot(queue[0]["url"]).acquire(blocking=False):
+                check = queue.popleft()
+                try:
+                    delay = _host_bucket(check["url"]).reserve()
+                except RateLimitedError:
+                    delay = 0  # The check fails with the error right away
+                check["throttle_wait"] = delay
+                if delay <= 0:
+                    self._start(check)
+                    continue
+                heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), check))
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="host-dispatcher", daemon=True)
+                    self._thread.start()
+                self._condition.notify()
+            if not queue:
+                self._queues.pop(host, None)
+
+    # Hand checks to their executor once their token is due
+    def _run(self):
+        with self._condition:
+            while True:
+                if not self._delayed:
+                    self._condition.wait()
+                    continue
+                wait = self._delayed[0][0] - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                self._start(heapq.heappop(self._delayed)[2])
+
+    def _start(self, check):
+        try:
+            check["executor"].submit(self._execute, check)
+        except RuntimeError as e:
+            # The executor was shut down while the check waited
+            _release_host_slot(check["url"])
+            check["future"].set_exception(e)
+
+    def _execute(self, check):
+        try:
+            result = check["fn"](throttle_wait=check["throttle_wait"])
+        except BaseException as e:
+            _release_host_slot(check["url"])
+            check["future"].set_exception(e)
+            return
+        _release_host_slot(check["url"])
+        check["future"].set_result(result)
+
+_dispatcher = _HostDispatcher()
+
+# Run fn(throttle_wait=...) on the executor once the host of url has a free slot
+# and a rate-limit token, and return its future. throttle_wait is how long the
+# check waited for its token; fn passes it on to run_check.
+def dispatch_check(executor, url, fn):
+    return _dispatcher.submit(executor, url, fn)
+
+# throttle_wait is set for checks started by dispatch_check, which already hold a
+# host slot and token. Other checks wait for both in the calling thread.
+# RateLimitedError and CircuitOpenError raised before the request leave the
+# circuit as it was: the host wasn't asked, so nothing was learned about it.
+def check_site_limited(site, throttle_wait=None, **options):
+    # Fail fast for hosts that keep failing, without waiting for a slot
+    circuit = _host_circuit(site["url"])
+    circuit.allow()
+    try:
+        if throttle_wait is None:
+            _host_slot(site["url"]).acquire()
+            try:
+                with current_check().phase("throttle"):
+                    time.sleep(_host_bucket(site["url"]).reserve())
+                return _check_site_reachable(site, circuit, options)
+            finally:
+                _release_host_slot(site["url"])
+        current_check().add("throttle", throttle_wait)
+        # The host may have asked to back off while the check waited
+        _host_bucket(site["url"]).raise_if_blocked()
+        return _check_site_reachable(site, circuit, options)
+    except RateLimitedError:
+        circuit.skipped()
+        raise
+
+# Check a site and tell its host's circuit breaker whether the host answered
+def _check_site_reachable(site, circuit, options):
+    try:
+        change = check_site(site, **options)
+    except Exception as e:
+        if _host_failure(e):
+            circuit.failed()
+        else:
+            circuit.succeeded()
+        raise
+    circuit.succeeded()
+    return change
+
+# Check a site and describe the outcome as a compact result record,
+# which is also appended to the check history log
+def run_check(site, throttle_wait=None, **options):
+    checked_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    result = {"site_id": site["id"], "url": site["url"], "checked_at": checked_at}
+    previous_change = site.get("last_changed")
+    timer = start_check(site["id"])
+    try:
+        change = check_site_limited(site, throttle_wait, **options)
+        result.update(status="changed" if change else "unchanged", changed=bool(change), error=None, change=change)
+        update_adaptive_interval(site, bool(change), previous_change, checked_at)
+        site["consecutive_failures"] = 0
+        finish_check(timer, result["status"])
+    except (RateLimitedError, CircuitOpenError) as e:
+        # Skipped without a request, or throttled by the host: that isn't a
+        # failure of the site, so it doesn't count toward its backoff
+        print(f"Skipped {site['url']}: {e}")
+        result.update(status="skipped", changed=False, error=str(e), change=None)
+        finish_check(timer, result["status"], e)
+    except Exception as e:
+        print(f"Error checking {site['url']}: {e}")
+        result.update(status="error", changed=False, error=str(e), change=None)
+        # Failing sites are checked again with a growing backoff, see adaptive.py
+        site["consecutive_failures"] = (site.get("consecutive_failures") or 0) + 1
+        site["last_failed"] = checked_at
+        finish_check(timer, result["status"], e)
+
+    try:
+        append_history({
+            "timestamp": checked_at,
+            "site_id": site["id"],
+            "url": site["url"],
+            "status": result["status"],
+        })
+    except OSError as e:
+        print(f"History error: {e}")
+    return result
+
+# Check all websites concurrently. A sweep takes as long as the slowest site
+# rather than the sum of all sites. Returns one result record per site.
+def check_all_sites(websites, skip_ssl_verification=False, enable_email=True, enable_telegram=True,
+                    max_workers=MAX_CONCURRENT_CHECKS):
+    if not websites:
+        return []
+
+    options = {
+        "skip_ssl_verification": skip_ssl_verification,
+        "enable_email": enable_email,
+        "enable_telegram": enable_telegram,
+    }
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(websites))) as executor:
+        futures = [dispatch_check(executor, site["url"], partial(run_check, site, **options)) for site in websites]
+        return [future.result() for future in as_completed(futures)]
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+
+import store
+from checker import MAX_CONCURRENT_CHECKS
+from metrics import serve_metrics
+from monitor import check_stored_site, result_summary, sweep
+from notifier import get_outbox
+from scheduler import MonitorScheduler
+from worker import run_workers
+
+# Command line entry point, without Streamlit:
+#   python -m cli list             show the configured websites
+#   python -m cli sweep            check every active website once
+#   python -m cli check SITE_ID    check a single website
+#   python -m cli run              monitor continuously, like "Start Monitoring" in the UI
+#   python -m cli work             monitor continuously in lease-based worker processes,
+#                                  which may run on several machines sharing the store
+# Results are printed as JSON, one object per line. Configuration comes from the
+# same environment variables and .env file as the web UI.
+
+def _print_json(data):
+    print(json.dumps(data, ensure_ascii=False), flush=True)
+
+def _print_result(result):
+    _print_json(result_summary(result))
+
+def _list():
+    for site in store.read_websites():
+        _print_json({key: site.get(key) for key in ("id", "name", "url", "interval", "active", "monitor_type", "last_checked", "last_changed")})
+    return 0
+
+def _sweep(options):
+    results = sweep(**options)
+    for result in results:
+        _print_result(result)
+    get_outbox().flush()
+    return 1 if any(result["status"] == "error" for result in results) else 0
+
+def _check(site_id, options):
+    result = check_stored_site(site_id, **options)
+    if result is None:
+        print(f"No website with ID {site_id}", file=sys.stderr)
+        return 2
+    _print_result(result)
+    get_outbox().flush()
+    return 1 if result["status"] == "error" else 0
+
+def _run(options, metrics_port):
+    if metrics_port:
+        serve_metrics(metrics_port)
+    scheduler = MonitorScheduler(on_result=_print_result)
+    scheduler.start(**options)
+
+    # Containers stop with SIGTERM, treat it like Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(3600)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        scheduler.stop()
+        get_outbox().flush()
+    return 0
+
+def _work(options, processes, threads, metrics_port):
+    run_workers(processes, max_workers=threads, on_result=_print_result, metrics_port=metrics_port, **options)
+    return 0
+
+def main(argv=None):
+    # Options shared by the commands that check websites
+    check_options = argparse.ArgumentParser(add_help=False)
+    check_options.add_argument("--skip-ssl-verification", action="store_true", help="don't verify SSL certificates")
+    check_options.add_argument("--no-email", action="store_true", help="don't send email notifications")
+    check_options.add_argument("--no-telegram", action="store_true", help="don't send Telegram notifications")
+
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Website Change Detector without the web UI")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show the configured websites")
+    commands.add_parser("sweep", parents=[check_options], help="check every active website once")
+    check = commands.add_parser("check", parents=[check_options], help="check a single website")
+    check.add_argument("site_id")
+    # Options of the long-running commands
+    service_options = argparse.ArgumentParser(add_help=False)
+    service_options.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port "
+                                 "(worker processes use consecutive ports)")
+
+    commands.add_parser("run", parents=[check_options, service_options], help="monitor all active websites continuously")
+    work = commands.add_parser("work", parents=[check_options, service_options],
+                               help="monitor continuously in lease-based worker processes")
+    work.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    work.add_argument("--threads", type=int, default=MAX_CONCURRENT_CHECKS, help="concurrent checks per process")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        return _list()
+
+    options = {
+        "skip_ssl_verification": args.skip_ssl_verification,
+        "enable_email": not args.no_email,
+        "enable_telegram": not args.no_telegram,
+    }
+    if args.command == "sweep":
+        return _sweep(options)
+    if args.command == "check":
+        return _check(args.site_id, options)
+    if args.command == "work":
+        return _work(options, args.processes, args.threads, args.metrics_port)
+    return _run(options, args.metrics_port)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from importlib.util import find_spec
+
+# BeautifulSoup is imported on first use, finding it doesn't load it
+BEAUTIFUL_SOUP_AVAILABLE = find_spec("bs4") is not None
+
+# Parser backend for BeautifulSoup. The default is Python's built-in html.parser.
+# "lxml" is faster, but repairs malformed nesting differently, so on such pages
+# it yields other room IDs than html.parser. Switching an existing installation
+# to it reports those listings as new once.
+HTML_PARSER = os.getenv("HTML_PARSER", "html.parser")
+
+# Candidate patterns, compiled once
+ROOM_TAGS = frozenset(["div", "article", "li", "section"])
+ROOM_CLASS_PATTERN = re.compile(r'.*(wohnung|zimmer|angebot|room|listing|item).*', re.I)
+PRICE_PATTERN = re.compile(r'€|EUR|Euro|\d+\s*€', re.I)
+ROOM_LINK_PATTERN = re.compile(r'.*(wohnung|zimmer|angebot).*', re.I)
+# Tokens for the fallback scanner: listing keywords, digit runs and euro signs
+FALLBACK_TOKEN_PATTERN = re.compile(r'(wohnung|zimmer|angebot)|\d+|€', re.IGNORECASE)
+FALLBACK_KEYWORDS = ("wohnung", "zimmer", "angebot")
+
+# Hard budget for the fallback scanner, per page
+FALLBACK_MAX_CHARS = int(os.getenv("FALLBACK_MAX_CHARS", str(2 * 1024 * 1024)))
+FALLBACK_TIME_BUDGET = float(os.getenv("FALLBACK_TIME_BUDGET", "2"))
+
+# Listing pages are only considered complete enough below this many candidates
+MIN_ROOM_CANDIDATES = 5
+
+# Extracted room lists of this many distinct pages are kept, shared by all sites
+ROOM_CACHE_SIZE = int(os.getenv("ROOM_CACHE_SIZE", "256"))
+
+def _resolve_parser():
+    if HTML_PARSER == "lxml" and find_spec("lxml") is None:
+        print("HTML_PARSER=lxml but lxml is not installed, using html.parser")
+        return "html.parser"
+    return HTML_PARSER
+
+PARSER = _resolve_parser() if BEAUTIFUL_SOUP_AVAILABLE else None
+
+
+# Collects room candidates, hashing each distinct identifier only once.
+# `count` includes duplicates, like the candidate thresholds always have.
+class _RoomCollector:
+    def __init__(self):
+        self.rooms = []
+        self.count = 0
+        self._seen_identifiers = set()
+        self._seen_ids = set()
+
+    def add(self, text, min_length):
+        if not text or len(text) <= min_length:
+            return
+        self.count += 1
+        identifier = text[:100].strip()
+        if identifier in self._seen_identifiers:
+            return
+        self._seen_identifiers.add(identifier)
+        room_id = hashlib.md5(identifier.encode()).hexdigest()[:12]
+        if room_id in self._seen_ids:
+            return
+        self._seen_ids.add(room_id)
+        self.rooms.append({
+            "id": room_id,
+            "content": identifier,
+            "full_content": text[:300]
+        })
+
+# Room IDs are 12 hex digits, stored as integers in the seen-listing index
+def listing_number(room_id):
+    return int(room_id, 16)
+
+def _has_room_class(element):
+    classes = element.get("class")
+    if not classes:
+        return False
+    if isinstance(classes, str):
+        classes = [classes]
+    return any(ROOM_CLASS_PATTERN.search(value) for value in classes)
+
+# Linear-time extraction, used when BeautifulSoup is not available.
+#
+# Emits the same candidates as the regexes r'<Keyword>.*?\d+.*?€' (case-insensitive,
+# DOTALL) for Wohnung, Zimmer and Angebot did, without their backtracking: the page
+# is tokenized once, then each keyword occurrence is extended to the first digit run
+# after it and the first euro sign after that. The old r'€.*?\d+.*?(Wohnung|...)'
+# pattern only ever yielded the keyword itself, which is too short to be a room.
+def _extract_rooms_fallback(content):
+    content = content[:FALLBACK_MAX_CHARS]
+    deadline = time.monotonic() + FALLBACK_TIME_BUDGET
+
+    keyword_spans = {keyword[0]: [] for keyword in FALLBACK_KEYWORDS}
+    digit_starts = []
+    euro_positions = []
+    for count, token in enumerate(FALLBACK_TOKEN_PATTERN.finditer(content)):
+        if count % 1024 == 0 and time.monotonic() > deadline:
+            print("Fallback room extraction stopped: time budget exceeded")
+            break
+        if token.group(1):
+            keyword_spans[token.group(1)[0].lower()].append(token.span())
+        elif token.group() == "€":
+            euro_positions.append(token.start())
+        else:
+            digit_starts.append(token.start())
+
+    collector = _RoomCollector()
+    for keyword in FALLBACK_KEYWORDS:
+        position = 0
+        for start, end in keyword_spans[keyword[0]]:
+            if start < position:
+                continue  # Overlaps the previous match
+            digit = bisect_left(digit_starts, end)
+            if digit == len(digit_starts):
+                break
+            euro = bisect_left(euro_positions, digit_starts[digit] + 1)
+            if euro == len(euro_positions):
+                break
+            position = euro_positions[euro] + 1
+            match = content[start:position]
+            identifier = match[:100].strip()
+            if len(identifier) > 10:  # Only consider substantial content
+                collector.add(match, 0)
+            if time.monotonic() > deadline:
+                return collector.rooms
+    return collector.rooms
+
+# Extract room information from STWDO website
+def extract_stwdo_rooms(content):
+    if not BEAUTIFUL_SOUP_AVAILABLE:
+        return _extract_rooms_fallback(content)
+
+    from bs4 import BeautifulSoup, NavigableString, Tag
+    soup = BeautifulSoup(content, PARSER)
+
+    # One walk over the document collects all three kinds of candidates in document order:
+    # elements with room-related classes, text containing prices and links to room details
+    room_elements = []
+    price_elements = []
+    link_elements = []
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            if node.name in ROOM_TAGS and _has_room_class(node):
+                room_elements.append(node)
+            elif node.name == "a":
+                href = node.get("href")
+                if isinstance(href, str) and ROOM_LINK_PATTERN.search(href):
+                    link_elements.append(node)
+        elif isinstance(node, NavigableString) and PRICE_PATTERN.search(node):
+            price_elements.append(node)
+
+    collector = _RoomCollector()
+    for element in room_elements:
+        collector.add(element.get_text(strip=True), 20)
+
+    # Fall back to price text and then links if we haven't found enough rooms
+    if collector.count < MIN_ROOM_CANDIDATES:
+        for price_element in price_elements:
+            if price_element.parent:
+                collector.add(price_element.parent.get_text(strip=True), 20)
+
+    if collector.count < MIN_ROOM_CANDIDATES:
+        for link_element in link_elements:
+            collector.add(link_element.get_text(strip=True), 10)
+
+    return collector.rooms
+
+
+# Least recently used cache from content hash to the rooms extracted from that content
+_room_cache = OrderedDict()
+_room_cache_lock = threading.Lock()
+
+def cached_rooms(content_hash):
+    with _room_cache_lock:
+        rooms = _room_cache.get(content_hash)
+        if rooms is None:
+            return None
+        _room_cache.move_to_end(content_hash)
+        return list(rooms)
+
+# Extract rooms, reusing the result for content that was parsed before
+def extract_stwdo_rooms_cached(content, content_hash):
+    rooms = cached_rooms(content_hash)
+    if rooms is not None:
+        return rooms
+    rooms = extract_stwdo_rooms(content)
+    with _room_cache_lock:
+        _room_cache[content_hash] = rooms
+        _room_cache.move_to_end(content_hash)
+        while len(_room_cache) > ROOM_CACHE_SIZE:
+            _room_cache.popitem(last=False)
+    return list(rooms)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import re
+
+# Content-defined chunking with a Gear rolling hash. A chunk ends where the top
+# bits of the hash over the last 64 bytes are all zero, so boundaries move with
+# the content: an edit only changes the chunks around it, and a per-site list of
+# (length, digest) pairs is enough to tell which byte ranges of a page changed.
+# Chunking runs per byte in Python, so checks only fingerprint a page whose
+# content hash changed (or that has no fingerprint yet).
+CHANGE_LOCALIZATION = os.getenv("CHANGE_LOCALIZATION", "true").lower() in ("1", "true", "yes")
+
+MIN_CHUNK_SIZE = 512
+MAX_CHUNK_SIZE = 8192
+AVERAGE_CHUNK_BITS = 11  # About 2 KiB between boundaries on average
+WINDOW_SIZE = 64  # A 64-bit Gear hash only depends on the last 64 bytes
+
+_MASK64 = (1 << 64) - 1
+_BOUNDARY_MASK = ((1 << AVERAGE_CHUNK_BITS) - 1) << (64 - AVERAGE_CHUNK_BITS)
+_GEAR = [int.from_bytes(hashlib.blake2b(bytes([value]), digest_size=8).digest(), "little") for value in range(256)]
+
+# Changed regions reported per notification, and snippet length per region
+MAX_REPORTED_REGIONS = 3
+SNIPPET_LENGTH = 120
+
+_TAG_PATTERN = re.compile(r'<[^>]*>|^[^<]*>|<[^>]*$')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def _snippet(data):
+    text = data.decode("utf-8", errors="replace")
+    text = _WHITESPACE_PATTERN.sub(" ", _TAG_PATTERN.sub(" ", text)).strip()
+    if len(text) > SNIPPET_LENGTH:
+        text = text[:SNIPPET_LENGTH - 1] + "…"
+    return text
+
+
+# Streaming chunker. Feed the page with update(), then finish() returns the new
+# fingerprint; `changes` lists [start, end, snippet] for every byte range whose
+# chunks are not in the previous fingerprint.
+class Fingerprinter:
+    def __init__(self, previous=None):
+        self.chunks = []
+        self.changes = []
+        self._previous = {digest for _, digest in previous} if previous else None
+        self._buffer = bytearray()
+        self._hash = 0
+        self._offset = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        position = 0
+        while position < len(data):
+            length = len(self._buffer)
+
+            # Bytes that can't influence the next boundary are copied without hashing
+            skip = MIN_CHUNK_SIZE - WINDOW_SIZE - length
+            if skip > 0:
+                piece = data[position:position + skip]
+                self._buffer += piece
+                position += len(piece)
+                continue
+
+            h = self._hash
+            limit = min(len(data), position + MAX_CHUNK_SIZE - length)
+            boundary = False
+            index = position
+            for value in data[position:limit]:
+                h = ((h << 1) + _GEAR[value]) & _MASK64
+                index += 1
+                if not h & _BOUNDARY_MASK and length + index - position >= MIN_CHUNK_SIZE:
+                    boundary = True
+                    break
+            self._buffer += data[position:index]
+            self._hash = h
+            position = index
+
+            if boundary or len(self._buffer) >= MAX_CHUNK_SIZE:
+                self._emit()
+
+    def finish(self):
+        if self._buffer:
+            self._emit()
+        return self.chunks
+
+    def _emit(self):
+        data = bytes(self._buffer)
+        digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+        self.chunks.append([len(data), digest])
+
+        start = self._offset
+        self._offset += len(data)
+        if self._previous is not None and digest not in self._previous:
+            if self.changes and self.changes[-1][1] == start:
+                self.changes[-1][1] = self._offset  # Extend the adjacent changed range
+            else:
+                self.changes.append([start, self._offset, _snippet(data)])
+
+        self._buffer = bytearray()
+        self._hash = 0
+
+# Human-readable summary of changed regions for notifications
+def describe_changes(changes):
+    lines = []
+    for start, end, snippet in changes[:MAX_REPORTED_REGIONS]:
+        lines.append(f"• bytes {start}–{end}: {snippet}" if snippet else f"• bytes {start}–{end}")
+    if len(changes) > MAX_REPORTED_REGIONS:
+        lines.append(f"… and {len(changes) - MAX_REPORTED_REGIONS} more changed region(s)")
+    return "\n".join(lines)
@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+
+# Line-delimited check history. The active file is rotated once it reaches
+# HISTORY_MAX_BYTES and HISTORY_BACKUP_COUNT rotated files are kept, so the
+# history never grows beyond (HISTORY_BACKUP_COUNT + 1) * HISTORY_MAX_BYTES.
+HISTORY_FILE = os.getenv("HISTORY_FILE", "monitoring_history.jsonl")
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(1024 * 1024)))
+HISTORY_BACKUP_COUNT = int(os.getenv("HISTORY_BACKUP_COUNT", "3"))
+
+_READ_BLOCK_SIZE = 8192
+
+_history_lock = threading.Lock()
+
+def _rotated_file(index):
+    return f"{HISTORY_FILE}.{index}"
+
+def _rotate():
+    if HISTORY_BACKUP_COUNT <= 0:
+        os.remove(HISTORY_FILE)
+        return
+    for index in range(HISTORY_BACKUP_COUNT - 1, 0, -1):
+        if os.path.exists(_rotated_file(index)):
+            os.replace(_rotated_file(index), _rotated_file(index + 1))
+    os.replace(HISTORY_FILE, _rotated_file(1))
+
+# Append one compact record to the history log
+def append_history(record):
+    line = (json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+    with _history_lock:
+        try:
+            size = os.path.getsize(HISTORY_FILE)
+        except FileNotFoundError:
+            size = 0
+        if size and size + len(line) > HISTORY_MAX_BYTES:
+            _rotate()
+        with open(HISTORY_FILE, "ab") as f:
+            f.write(line)
+
+# Read up to `count` complete lines from the end of a file without reading the whole file
+def _read_last_lines(path, count):
+    if count <= 0:
+        return []
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return []
+
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        buffer = b""
+        lines = []
+        while position > 0 and len(lines) <= count:
+            read_size = min(_READ_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            buffer = f.read(read_size) + buffer
+            lines = buffer.split(b"\n")
+        # Without reaching the start of the file the first piece may be a partial line
+        if position > 0:
+            lines = lines[1:]
+        return [line for line in lines if line.strip()][-count:]
+
+# Last `count` history entries, oldest first
+def tail_history(count=5):
+    raw_lines = []
+    paths = [HISTORY_FILE] + [_rotated_file(index) for index in range(1, HISTORY_BACKUP_COUNT + 1)]
+    with _history_lock:
+        for path in paths:
+            raw_lines = _read_last_lines(path, count - len(raw_lines)) + raw_lines
+            if len(raw_lines) >= count:
+                break
+
+    entries = []
+    for line in raw_lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue  # Skip a line cut short by a crash
+    return entries
@@ -1,33 +1,19 @@
 import streamlit as st
-import requests
-import hashlib
-import time
-import os
-from dotenv import load_dotenv
-import smtplib
-from email.mime.text import MIMEText
-from datetime import datetime
-import json
-import urllib3
-import re
-
-# Try to import BeautifulSoup, but handle if it's not available
-try:
-    from bs4 import BeautifulSoup
-    BEAUTIFUL_SOUP_AVAILABLE = True
-except ImportError:
-    BeautifulSoup = None
-    BEAUTIFUL_SOUP_AVAILABLE = False
+import threading
+
+import monitor
+import store
+from adaptive import site_interval
+from extractor import BEAUTIFUL_SOUP_AVAILABLE
+from history import tail_history
+from metrics import registry
+from profiling import PROFILE_DIR, PROFILE_EVERY, profiler
+from scheduler import MonitorScheduler
+from scope import validate_selector
+
+if not BEAUTIFUL_SOUP_AVAILABLE:
     st.warning(" BeautifulSoup library not found. STWDO room detection will use fallback method. Please install with: pip install beautifulsoup4")
 
-# Load environment variables
-load_dotenv()
-EMAIL_SENDER = os.getenv("EMAIL_SENDER", "")
-EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")
-EMAIL_RECEIVER = os.getenv("EMAIL_RECEIVER", "")
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
-TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
-
 # Set up the page configuration
 st.set_page_config(
     page_title="Website Change Detector", 
@@ -174,9 +160,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if "websites" not in st.session_state:
-    st.session_state.websites = []
-
 if "editing_website" not in st.session_state:
     st.session_state.editing_website = None
 
@@ -187,60 +170,48 @@ if "delete_confirm" not in st.session_state:
 st.markdown("<h1 class='main-header'>🌐 Website Change Detector</h1>", unsafe_allow_html=True)
 st.markdown("<p style='text-align: center; font-size: 1.2rem; color: #666;'>Monitor multiple websites for changes and get instant notifications</p>", unsafe_allow_html=True)
 
-# Load websites from file
+# Website list shared by all sessions. The store is only read again after its
+# version changed, i.e. after a write from this or any other process.
+class WebsiteCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._websites = []
+
+    def get(self):
+        version = store.store_version()
+        with self._lock:
+            if version != self._version:
+                self._websites = store.read_websites()
+                self._version = version
+            return self._websites
+
+@st.cache_resource
+def get_website_cache():
+    return WebsiteCache()
+
+# Load websites, from the shared cache unless the store changed
 def load_websites():
-    if os.path.exists("websites.json"):
-        with open("websites.json", "r") as f:
-            st.session_state.websites = json.load(f)
-    else:
-        st.session_state.websites = []
+    return get_website_cache().get()
 
-# Save websites to file
-def save_websites():
-    with open("websites.json", "w") as f:
-        json.dump(st.session_state.websites, f)
+# Background scheduler shared by all sessions, it survives reruns and closed tabs
+@st.cache_resource
+def get_scheduler():
+    return MonitorScheduler()
 
 # Add or update website
-def add_or_update_website(url, name, interval, active, monitor_type="any_change"):
-    website_data = {
-        "id": hashlib.md5(url.encode()).hexdigest()[:8],
-        "url": url,
-        "name": name,
-        "interval": interval,
-        "active": active,
-        "monitor_type": monitor_type,  # "any_change" or "stwdo_rooms"
-        "last_checked": None,
-        "last_changed": None,
-        "current_hash": None,
-        "previous_rooms": [],
-        "first_scan_completed": False
-    }
-    
-    # Check if website already exists
-    existing_index = None
-    for i, site in enumerate(st.session_state.websites):
-        if site["url"] == url:
-            existing_index = i
-            break
-    
-    if existing_index is not None:
-        # Update existing website
-        st.session_state.websites[existing_index] = website_data
-    else:
-        # Add new website
-        st.session_state.websites.append(website_data)
-    
-    save_websites()
+def add_or_update_website(url, name, interval, active, monitor_type="any_change", selector="", adaptive=False):
+    # The ID is derived from the URL, so this adds a new website or replaces the existing one
+    store.upsert_website(monitor.new_website(url, name, interval, active, monitor_type, selector, adaptive))
 
 # Delete website
 def delete_website(site_id):
-    st.session_state.websites = [site for site in st.session_state.websites if site["id"] != site_id]
-    save_websites()
+    monitor.delete_website(site_id)
     st.session_state.delete_confirm = None
 
 # Edit website - set editing state
 def edit_website(site_id):
-    for site in st.session_state.websites:
+    for site in load_websites():
         if site["id"] == site_id:
             st.session_state.editing_website = site
             break
@@ -249,168 +220,8 @@ def edit_website(site_id):
 def confirm_delete_website(site_id):
     st.session_state.delete_confirm = site_id
 
-# Send email notification
-def send_email_notification(url, site_name, message=""):
-    if not EMAIL_SENDER or not EMAIL_PASSWORD or not EMAIL_RECEIVER:
-        return False
-        
-    try:
-        subject = "🔔 Website Change Detected"
-        body = f"{message}\n\nWebsite: {site_name}\nURL: {url}\nTime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        msg = MIMEText(body)
-        msg["Subject"] = subject
-        msg["From"] = EMAIL_SENDER
-        msg["To"] = EMAIL_RECEIVER
-
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"Email error: {e}")
-        return False
-
-# Send Telegram notification
-def send_telegram_notification(url, site_name, message=""):
-    if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
-        return False
-        
-    try:
-        full_message = f"🔔 {message}\n\nWebsite: {site_name}\nURL: {url}\nTime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        response = requests.post(
-            f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage",
-            data={"chat_id": TELEGRAM_CHAT_ID, "text": full_message}
-        )
-        return response.status_code == 200
-    except Exception as e:
-        print(f"Telegram error: {e}")
-        return False
-
-# Extract room information from STWDO website
-def extract_stwdo_rooms(content):
-    # If BeautifulSoup is not available, use a simpler approach
-    if not BEAUTIFUL_SOUP_AVAILABLE or BeautifulSoup is None:
-        # Simple regex-based extraction
-        rooms = []
-        # Look for patterns that might indicate room listings
-        patterns = [
-            r'Wohnung.*?\d+.*?€',
-            r'Zimmer.*?\d+.*?€',
-            r'Angebot.*?\d+.*?€',
-            r'€.*?\d+.*?(Wohnung|Zimmer|Angebot)',
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, content, re.IGNORECASE | re.DOTALL)
-            for match in matches:
-                if isinstance(match, tuple):
-                    match = ' '.join(match)
-                identifier = match[:100].strip()
-                if len(identifier) > 10:  # Only consider substantial content
-                    rooms.append({
-                        "id": hashlib.md5(identifier.encode()).hexdigest()[:12],
-                        "content": identifier,
-                        "full_content": match[:300]
-                    })
-        
-        # Remove duplicates based on ID
-        unique_rooms = []
-        seen_ids = set()
-        for room in rooms:
-            if room["id"] not in seen_ids:
-                unique_rooms.append(room)
-                seen_ids.add(room["id"])
-        
-        return unique_rooms
-    
-    # If BeautifulSoup is available, use the more sophisticated approach
-    soup = BeautifulSoup(content, 'html.parser')
-    rooms = []
-    
-    # Look for room listings - this may need adjustment based on the actual HTML structure
-    # Try multiple approaches to find room listings
-    
-    # Approach 1: Look for elements with common room-related classes
-    room_elements = soup.find_all(['div', 'article', 'li', 'section'], 
-                                 class_=re.compile(r'.*(wohnung|zimmer|angebot|room|listing|item).*', re.I))
-    
-    # Approach 2: Look for elements containing price information
-    price_elements = soup.find_all(text=re.compile(r'€|EUR|Euro|\d+\s*€', re.I))
-    
-    # Approach 3: Look for links that might contain room details
-    link_elements = soup.find_all('a', href=re.compile(r'.*(wohnung|zimmer|angebot).*', re.I))
-    
-    # Process room elements
-    for element in room_elements:
-        # Get text content
-        text = element.get_text(strip=True)
-        if text and len(text) > 20:  # Only consider substantial content
-            # Create a unique identifier for this room based on key details
-            identifier = text[:100].strip()  # Use first 100 chars as identifier
-            rooms.append({
-                "id": hashlib.md5(identifier.encode()).hexdigest()[:12],
-                "content": identifier,
-                "full_content": text[:300]  # Store first 300 chars for reference
-            })
-    
-    # Process price elements if we haven't found enough rooms
-    if len(rooms) < 5:  # Arbitrary threshold
-        for price_element in price_elements:
-            parent = price_element.parent
-            if parent:
-                text = parent.get_text(strip=True)
-                if text and len(text) > 20:
-                    identifier = text[:100].strip()
-                    rooms.append({
-                        "id": hashlib.md5(identifier.encode()).hexdigest()[:12],
-                        "content": identifier,
-                        "full_content": text[:300]
-                    })
-    
-    # Process link elements if we haven't found enough rooms
-    if len(rooms) < 5:
-        for link_element in link_elements:
-            try:
-                text = link_element.get_text(strip=True)
-                if text and len(text) > 10:
-                    # Skip href extraction to avoid attribute access issues
-                    identifier = text[:100].strip()
-                    rooms.append({
-                        "id": hashlib.md5(identifier.encode()).hexdigest()[:12],
-                        "content": identifier,
-                        "full_content": text[:300]
-                    })
-            except Exception:
-                # Skip elements that cause issues
-                continue
-    
-    # Remove duplicates based on ID
-    unique_rooms = []
-    seen_ids = set()
-    for room in rooms:
-        if room["id"] not in seen_ids:
-            unique_rooms.append(room)
-            seen_ids.add(room["id"])
-    
-    return unique_rooms
-
-# Detect new rooms on STWDO website
-def detect_new_rooms(current_content, previous_rooms):
-    current_rooms = extract_stwdo_rooms(current_content)
-    
-    # Convert previous_rooms to set of IDs for comparison
-    previous_room_ids = set(room["id"] for room in previous_rooms)
-    
-    # Find new rooms (in current but not in previous)
-    new_rooms = []
-    for room in current_rooms:
-        if room["id"] not in previous_room_ids:
-            new_rooms.append(room)
-    
-    return new_rooms, current_rooms
-
-# Load websites on app start
-load_websites()
+# Load websites on every rerun, cheap unless the store changed
+websites = load_websites()
 
 # Handle delete confirmation
 if st.session_state.delete_confirm:
@@ -439,18 +250,22 @@ with st.sidebar:
             name = st.text_input("📝 Website Name:", value=st.session_state.editing_website.get("name", ""))
             interval = st.number_input("⏱️ Check Interval (seconds):", min_value=30, max_value=3600, 
                                      value=st.session_state.editing_website["interval"], step=30)
+            adaptive = st.checkbox("📈 Adapt interval to how often the page changes", value=st.session_state.editing_website.get("adaptive") or False)
             active = st.checkbox("✅ Active", value=st.session_state.editing_website["active"])
             monitor_type = st.radio("🔍 Monitoring Type:", 
                                   ["Any Change", "STWDO Room Detection"], 
                                   index=0 if st.session_state.editing_website.get("monitor_type", "any_change") == "any_change" else 1)
+            selector = st.text_input("🎯 CSS Selector / XPath (optional):", value=st.session_state.editing_website.get("selector") or "")
         else:
             url = st.text_input("🔗 Website URL:", placeholder="https://example.com")
             name = st.text_input("📝 Website Name:", placeholder="My Website")
             interval = st.number_input("⏱️ Check Interval (seconds):", min_value=30, max_value=3600, value=60, step=30)
+            adaptive = st.checkbox("📈 Adapt interval to how often the page changes", value=False)
             active = st.checkbox("✅ Active", value=True)
             monitor_type = st.radio("🔍 Monitoring Type:", 
                                   ["Any Change", "STWDO Room Detection"], 
                                   index=0)
+            selector = st.text_input("🎯 CSS Selector / XPath (optional):", placeholder="#content or //main")
         
         # Buttons
         col1, col2, col3 = st.columns(3)
@@ -467,10 +282,15 @@ with st.sidebar:
             if url and url.strip() != "":
                 name_value = name if name and name.strip() != "" else url
                 monitor_type_value = "stwdo_rooms" if monitor_type == "STWDO Room Detection" else "any_change"
-                add_or_update_website(url, name_value, interval, active, monitor_type_value)
-                st.success("✅ Website saved successfully!")
-                st.session_state.editing_website = None
-                st.rerun()
+                try:
+                    validate_selector(selector)
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    add_or_update_website(url, name_value, interval, active, monitor_type_value, selector, adaptive)
+                    st.success("✅ Website saved successfully!")
+                    st.session_state.editing_website = None
+                    st.rerun()
             else:
                 st.error("❌ Please enter a valid URL")
         
@@ -488,120 +308,119 @@ with st.sidebar:
     enable_email = st.checkbox("Enable Email Notifications", value=True)
     enable_telegram = st.checkbox("Enable Telegram Notifications", value=True)
     skip_ssl_verification = st.checkbox("Skip SSL Verification", value=False)
+    profiler.enabled = st.checkbox("Profile Check Cycles", value=profiler.enabled,
+                                   help=f"Profiles one check cycle in {PROFILE_EVERY} into the {PROFILE_DIR} directory")
     
     st.markdown("---")
     st.markdown("<h3 class='sub-header'>📊 Monitoring History</h3>", unsafe_allow_html=True)
     
-    # Display monitoring history if exists
-    if os.path.exists("monitoring_history.json"):
-        with open("monitoring_history.json", "r") as f:
-            history = json.load(f)
-        for item in history[-5:]:  # Show last 5 items
-            st.markdown(f"<div class='notification-card info'>{item['timestamp']}<br>{item['url']}</div>", unsafe_allow_html=True)
+    # Display the most recent checks, read from the end of the history log
+    for item in tail_history(5):
+        st.markdown(f"<div class='notification-card info'>{item['timestamp']}<br>{item['url']}</div>", unsafe_allow_html=True)
 
 # Main content area
 st.markdown("<h2 class='sub-header'>📋 Monitored Websites</h2>", unsafe_allow_html=True)
 
-# Display websites in a clean format
-if st.session_state.websites:
-    for i, site in enumerate(st.session_state.websites):
-        # Website header with name
-        st.markdown(f"<div class='website-header'>{site.get('name', site['url'])}</div>", unsafe_allow_html=True)
-        
-        # Website details
-        col1, col2 = st.columns([3, 1])
+# Dashboard rows, rebuilt only when the store version changes
+@st.cache_data(max_entries=4)
+def load_site_table(version):
+    statuses = store.read_latest_check_statuses()
+    return [
+        {
+            "id": site["id"],
+            "Name": site.get("name") or site["url"],
+            "URL": site["url"],
+            "Monitor Type": "STWDO Room Detection" if site.get("monitor_type") == "stwdo_rooms" else "Any Change",
+            "Selector": site.get("selector") or "",
+            "Interval (s)": site_interval(site),
+            "Adaptive": "Yes" if site.get("adaptive") else "No",
+            "Status": "Active" if site["active"] else "Inactive",
+            "Last Result": statuses.get(site["id"], "never checked"),
+            "Failures in a Row": site.get("consecutive_failures") or 0,
+            "Last Checked": site.get("last_checked") or "",
+            "Last Changed": site.get("last_changed") or "",
+        }
+        for site in load_websites()
+    ]
+
+SORT_COLUMNS = ["Name", "Status", "Last Result", "Last Checked", "Last Changed", "Interval (s)"]
+PAGE_SIZES = [25, 50, 100, 250]
+
+# Display websites as one paginated table, filtered and sorted before rendering
+if websites:
+    rows = load_site_table(store.store_version())
+
+    col1, col2, col3, col4 = st.columns([3, 1, 1, 2])
+    with col1:
+        search = st.text_input("🔎 Search name or URL:", key="table_search")
+    with col2:
+        status_filter = st.selectbox("Status:", ["All", "Active", "Inactive"], key="table_status")
+    with col3:
+        result_filter = st.selectbox("Last Result:", ["All", "changed", "unchanged", "error", "skipped", "never checked"], key="table_result")
+    with col4:
+        sort_column = st.selectbox("Sort by:", SORT_COLUMNS, key="table_sort")
+        descending = st.checkbox("Descending", value=False, key="table_descending")
+
+    if search:
+        needle = search.lower()
+        rows = [row for row in rows if needle in row["Name"].lower() or needle in row["URL"].lower()]
+    if status_filter != "All":
+        rows = [row for row in rows if row["Status"] == status_filter]
+    if result_filter != "All":
+        rows = [row for row in rows if row["Last Result"] == result_filter]
+    rows = sorted(rows, key=lambda row: row[sort_column] if isinstance(row[sort_column], int) else str(row[sort_column]).lower(),
+                  reverse=descending)
+
+    # Only the current page is sent to the browser
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        page_size = st.selectbox("Rows per page:", PAGE_SIZES, key="table_page_size")
+    page_count = max(1, -(-len(rows) // page_size))
+    with col2:
+        page = st.number_input("Page:", min_value=1, max_value=page_count, value=1, step=1, key="table_page")
+    page = min(page, page_count)
+    page_rows = rows[(page - 1) * page_size:page * page_size]
+    with col3:
+        st.markdown(f"<div class='website-info'><span class='info-label'>Showing:</span> <span class='info-value'>{len(page_rows)} of {len(rows)} website(s), page {page} of {page_count}</span></div>", unsafe_allow_html=True)
+
+    st.dataframe(
+        [{key: value for key, value in row.items() if key != "id"} for row in page_rows],
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    # Row actions work on the website picked here, so no per-row widgets are needed
+    if page_rows:
+        row_labels = {f"{row['Name']} ({row['URL']})": row["id"] for row in page_rows}
+        col1, col2, col3 = st.columns([4, 1, 1])
         with col1:
-            st.markdown(f"<div class='website-info'><span class='info-label'>URL:</span> <span class='info-value'>{site['url']}</span></div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='website-info'><span class='info-label'>Interval:</span> <span class='info-value'>{site['interval']} seconds</span></div>", unsafe_allow_html=True)
-            monitor_type_text = "STWDO Room Detection" if site.get("monitor_type") == "stwdo_rooms" else "Any Change"
-            st.markdown(f"<div class='website-info'><span class='info-label'>Monitor Type:</span> <span class='info-value'>{monitor_type_text}</span></div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='website-info'><span class='info-label'>Status:</span> <span class='info-value'>{'Active' if site['active'] else 'Inactive'}</span></div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='website-info'><span class='info-label'>Last Checked:</span> <span class='info-value'>{site['last_checked'] if site['last_checked'] else 'Never'}</span></div>", unsafe_allow_html=True)
+            selected_label = st.selectbox("Website:", list(row_labels.keys()), key="table_selected")
         with col2:
-            if st.button("✏️ Edit", key=f"edit_{site['id']}"):
-                edit_website(site["id"])
+            if st.button("✏️ Edit"):
+                edit_website(row_labels[selected_label])
                 st.rerun()
-            if st.button("🗑️ Delete", key=f"delete_{site['id']}"):
-                confirm_delete_website(site["id"])
+        with col3:
+            if st.button("🗑️ Delete"):
+                confirm_delete_website(row_labels[selected_label])
                 st.rerun()
-        
-        # Add separator except for the last item
-        if i < len(st.session_state.websites) - 1:
-            st.markdown("---")
+    else:
+        st.info("ℹ️ No websites match the current filters.")
     
     # Manual check button
     if st.button("🔍 Check All Websites Now"):
         st.info("Checking all websites for changes...")
-        changes_detected = []
-        
-        for site in st.session_state.websites:
-            try:
-                # Configure request based on SSL setting
-                if skip_ssl_verification:
-                    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-                    response = requests.get(site["url"], timeout=10, verify=False)
-                else:
-                    response = requests.get(site["url"], timeout=10)
-                
-                content = response.text
-                
-                # Update last checked time
-                site["last_checked"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                
-                if site.get("monitor_type") == "stwdo_rooms" and "stwdo.de" in site["url"]:
-                    # Special handling for STWDO room detection
-                    previous_rooms = site.get("previous_rooms", [])
-                    first_scan = not site.get("first_scan_completed", False)
-                    
-                    new_rooms, current_rooms = detect_new_rooms(content, previous_rooms)
-                    
-                    # Always update the rooms list
-                    site["previous_rooms"] = current_rooms
-                    site["first_scan_completed"] = True
-                    
-                    if not first_scan and new_rooms:
-                        # New rooms detected (not the first scan)
-                        site["last_changed"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        changes_detected.append({
-                            "site": site,
-                            "new_rooms": new_rooms
-                        })
-                        
-                        # Send notifications
-                        site_name = site.get('name', site['url'])
-                        message = f"New rooms detected on {site_name}!\n\nNew listings found: {len(new_rooms)}"
-                        if enable_email:
-                            send_email_notification(site["url"], site_name, message)
-                        if enable_telegram:
-                            send_telegram_notification(site["url"], site_name, message)
-                else:
-                    # Regular change detection
-                    current_hash = hashlib.md5(content.encode()).hexdigest()
-                    
-                    if site.get("current_hash") is None:
-                        site["current_hash"] = current_hash
-                    elif current_hash != site["current_hash"]:
-                        # Change detected
-                        site["last_changed"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        site["current_hash"] = current_hash
-                        changes_detected.append({"site": site})
-                        
-                        # Send notifications
-                        site_name = site.get('name', site['url'])
-                        message = f"Change detected on {site_name}!"
-                        if enable_email:
-                            send_email_notification(site["url"], site_name, message)
-                        if enable_telegram:
-                            send_telegram_notification(site["url"], site_name, message)
-                        
-                # Save updated website data
-                save_websites()
-                        
-            except Exception as e:
-                print(f"Error checking {site['url']}: {e}")
+        results = monitor.sweep(
+            active_only=False,
+            retry_failing=True,
+            skip_ssl_verification=skip_ssl_verification,
+            enable_email=enable_email,
+            enable_telegram=enable_telegram,
+        )
+        websites = load_websites()
+        changes_detected = [result for result in results if result["changed"]]
         
         if changes_detected:
-            st.success(f"Changes detected on {len(changes_detected)} website(s). Notifications sent.")
+            st.success(f"Changes detected on {len(changes_detected)} website(s). Notifications queued.")
         else:
             st.info("No changes detected on any websites.")
 else:
@@ -612,119 +431,71 @@ st.markdown("---")
 st.markdown("<h2 class='sub-header'>🎯 Monitor Specific Website</h2>", unsafe_allow_html=True)
 
 # Select website to monitor
-if st.session_state.websites:
-    website_options = {site.get("name", site["url"]): site for site in st.session_state.websites}
+if websites:
+    website_options = {site.get("name", site["url"]): site for site in websites}
     selected_name = st.selectbox("Select a website to monitor:", list(website_options.keys()))
     selected_site = website_options[selected_name]
     
+    scheduler = get_scheduler()
+
+    # Start monitoring button
+    start_button = st.button("▶️ Start Monitoring", key="start")
+    stop_button = st.button("⏹️ Stop Monitoring", key="stop")
+    
+    if start_button:
+        scheduler.start(
+            skip_ssl_verification=skip_ssl_verification,
+            enable_email=enable_email,
+            enable_telegram=enable_telegram,
+        )
+    if stop_button:
+        scheduler.stop()
+    
+    schedule = scheduler.snapshot()
+    if scheduler.running:
+        st.markdown(f"<div class='notification-card success'>▶️ Monitoring {len(schedule)} active website(s) in the background</div>", unsafe_allow_html=True)
+    else:
+        st.markdown("<div class='notification-card warning'>⏸️ Monitoring is stopped</div>", unsafe_allow_html=True)
+    
     if selected_site:
-        placeholder = st.empty()
-        prev_hash = selected_site.get("current_hash", None)
-        prev_rooms = selected_site.get("previous_rooms", [])
-        first_scan = not selected_site.get("first_scan_completed", False)
-        refresh_count = 0
-        monitoring = True
-
-        # Start monitoring button
-        start_button = st.button("▶️ Start Monitoring", key="start")
-        stop_button = st.button("⏹️ Stop Monitoring", key="stop")
-        
-        if start_button:
-            monitoring = True
-            st.session_state.monitoring = True
-        if stop_button:
-            monitoring = False
-            st.session_state.monitoring = False
-            
-        if "monitoring" not in st.session_state:
-            st.session_state.monitoring = False
-            
-        if st.session_state.monitoring:
-            while monitoring:
-                try:
-                    with st.spinner(f"🔍 Checking {selected_site['url']} for changes..."):
-                        # Configure request based on SSL setting
-                        if skip_ssl_verification:
-                            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-                            response = requests.get(selected_site["url"], timeout=10, verify=False)
-                        else:
-                            response = requests.get(selected_site["url"], timeout=10)
-                        
-                        content = response.text
-
-                    # Update last checked time
-                    selected_site["last_checked"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    if selected_site.get("monitor_type") == "stwdo_rooms" and "stwdo.de" in selected_site["url"]:
-                        # Special handling for STWDO room detection
-                        new_rooms, current_rooms = detect_new_rooms(content, prev_rooms)
-                        
-                        # Always update the rooms list
-                        selected_site["previous_rooms"] = current_rooms
-                        selected_site["first_scan_completed"] = True
-                        prev_rooms = current_rooms
-                        
-                        if not first_scan and new_rooms:
-                            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            # Send notifications only
-                            site_name = selected_site.get('name', selected_site['url'])
-                            message = f"New rooms detected on {site_name}!\n\nNew listings found: {len(new_rooms)}"
-                            if enable_email:
-                                send_email_notification(selected_site["url"], site_name, message)
-                            if enable_telegram:
-                                send_telegram_notification(selected_site["url"], site_name, message)
-                            
-                            # Update website data
-                            selected_site["last_changed"] = timestamp
-                        elif first_scan:
-                            # Mark first scan as completed
-                            first_scan = False
-                    else:
-                        # Regular change detection
-                        current_hash = hashlib.md5(content.encode()).hexdigest()
-
-                        if prev_hash is None:
-                            prev_hash = current_hash
-
-                        elif current_hash != prev_hash:
-                            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            # Send notifications only
-                            site_name = selected_site.get('name', selected_site['url'])
-                            message = f"Change detected on {site_name}!"
-                            if enable_email:
-                                send_email_notification(selected_site["url"], site_name, message)
-                            if enable_telegram:
-                                send_telegram_notification(selected_site["url"], site_name, message)
-                            
-                            # Update website data
-                            selected_site["last_changed"] = timestamp
-                            selected_site["current_hash"] = current_hash
-                            prev_hash = current_hash
-                        else:
-                            pass  # No change detected
-                    
-                    # Save updated website data
-                    for site in st.session_state.websites:
-                        if site["url"] == selected_site["url"]:
-                            site.update(selected_site)
-                            break
-                    save_websites()
-
-                    refresh_count += 1
-                    time.sleep(selected_site["interval"])
-
-                except requests.exceptions.SSLError as e:
-                    error_msg = f"🔒 SSL Certificate Error: {str(e)}"
-                    print(f"SSL Error for {selected_site['url']}: {error_msg}")
-                    break
-                except requests.exceptions.RequestException as e:
-                    print(f"Network error for {selected_site['url']}: {e}")
-                    break
-                except Exception as e:
-                    print(f"Error checking {selected_site['url']}: {e}")
-                    break
+        status = schedule.get(selected_site["id"])
+        if not selected_site["active"]:
+            st.info("ℹ️ This website is inactive and is not scheduled.")
+        elif status is None:
+            st.info("ℹ️ This website is not scheduled yet. Start monitoring to check it in the background.")
+        else:
+            if status["state"] == "checking":
+                next_check = "Checking now..."
+            elif scheduler.running:
+                next_check = f"in {int(status['due_in'])} seconds"
+            else:
+                next_check = "Paused"
+            interval_text = f"{site_interval(selected_site)} seconds" + (" (adaptive)" if selected_site.get("adaptive") else "")
+            st.markdown(f"<div class='website-info'><span class='info-label'>Interval:</span> <span class='info-value'>{interval_text}</span></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='website-info'><span class='info-label'>Next Check:</span> <span class='info-value'>{next_check}</span></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='website-info'><span class='info-label'>Last Checked:</span> <span class='info-value'>{status.get('last_checked') or 'Never'}</span></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='website-info'><span class='info-label'>Last Result:</span> <span class='info-value'>{status['last_error'] or status['last_result'] or '-'}</span></div>", unsafe_allow_html=True)
 else:
     st.info("ℹ️ Add websites using the form in the sidebar to begin monitoring.")
 
+# Timings of the checks run by this process
+st.markdown("---")
+with st.expander("⚡ Performance"):
+    phase_rows = registry.summary()
+    if phase_rows:
+        st.dataframe(phase_rows, use_container_width=True, hide_index=True)
+        st.markdown("**Slowest websites**")
+        names = {site["id"]: site.get("name", site["url"]) for site in websites}
+        slowest = registry.slowest_sites()
+        for row in slowest:
+            row["name"] = names.get(row["site_id"], row["site_id"])
+        st.dataframe(slowest, use_container_width=True, hide_index=True)
+        if slowest:
+            timed_site = st.selectbox("Phases of website:", [row["site_id"] for row in slowest],
+                                      format_func=lambda site_id: names.get(site_id, site_id))
+            st.dataframe(registry.summary(timed_site), use_container_width=True, hide_index=True)
+    else:
+        st.info("ℹ️ No checks have run yet.")
+
 # Footer
 st.markdown("<div class='footer'>Website Change Detector | Monitor your favorite websites for changes</div>", unsafe_allow_html=True)
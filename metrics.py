@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Per-check instrumentation. Every check records how long its phases took
+# (request until the response headers arrived, download, decode, hash,
+# extraction, persistence, notification), the bytes it transferred and the
+# HTTP status. Phases are aggregated into histograms overall and per site, and
+# rendered in the Prometheus text format by prometheus_text().
+METRICS_ENABLED = os.getenv("METRICS", "true").lower() in ("1", "true", "yes")
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# "throttle" is time spent waiting for the per-host rate limit
+PHASES = ("throttle", "ttfb", "download", "decode", "hash", "extract", "persist", "notify", "total")
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    # Estimate a quantile by interpolating within its bucket, narrowed to the
+    # smallest and largest observed values
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = max(BUCKETS[index - 1] if index > 0 else 0, self.min)
+                upper = min(BUCKETS[index] if index < len(BUCKETS) else self.max, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+# Timings of the check running on the current thread
+class CheckTimer:
+    def __init__(self, site_id):
+        self.site_id = site_id
+        self.phases = {}
+        self.bytes = 0
+        self.status_code = None
+        self.started = time.perf_counter()
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    @contextmanager
+    def phase(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started)
+
+
+# Stands in when no check is being timed, so instrumented code needs no checks
+class _NullTimer(CheckTimer):
+    def __init__(self):
+        super().__init__(None)
+
+    def add(self, phase, seconds):
+        pass
+
+    # Writes are dropped, the instance is shared by all threads
+    bytes = property(lambda self: 0, lambda self, value: None)
+    status_code = property(lambda self: None, lambda self, value: None)
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {}          # phase -> Histogram over all sites
+        self.site_phases = {}     # (site_id, phase) -> Histogram
+        self.checks = {}          # status -> count
+        self.responses = {}       # HTTP status code -> count
+        self.errors = {}          # exception type -> count
+        self.site_bytes = {}      # site_id -> bytes transferred
+
+    def _observe(self, phase, seconds, site_id=None):
+        self.phases.setdefault(phase, Histogram()).observe(seconds)
+        if site_id is not None:
+            self.site_phases.setdefault((site_id, phase), Histogram()).observe(seconds)
+
+    def observe(self, phase, seconds, site_id=None):
+        with self._lock:
+            self._observe(phase, seconds, site_id)
+
+    def record_check(self, timer, status, error=None):
+        timer.add("total", time.perf_counter() - timer.started)
+        with self._lock:
+            for phase, seconds in timer.phases.items():
+                self._observe(phase, seconds, timer.site_id)
+            self.checks[status] = self.checks.get(status, 0) + 1
+            if timer.status_code is not None:
+                self.responses[timer.status_code] = self.responses.get(timer.status_code, 0) + 1
+            if error is not None:
+                name = type(error).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+            self.site_bytes[timer.site_id] = self.site_bytes.get(timer.site_id, 0) + timer.bytes
+
+    # Per-phase count, mean and quantiles, overall or for one site
+    def summary(self, site_id=None):
+        rows = []
+        with self._lock:
+            for phase in PHASES + tuple(sorted(set(self.phases) - set(PHASES))):
+                histogram = self.phases.get(phase) if site_id is None else self.site_phases.get((site_id, phase))
+                if histogram is None or not histogram.count:
+                    continue
+                rows.append({
+                    "phase": phase,
+                    "count": histogram.count,
+                    "mean_ms": 1000 * histogram.sum / histogram.count,
+                    "p50_ms": 1000 * histogram.quantile(0.5),
+                    "p95_ms": 1000 * histogram.quantile(0.95),
+                    "p99_ms": 1000 * histogram.quantile(0.99),
+                })
+        return rows
+
+    # Sites ordered by their mean total check time, slowest first
+    def slowest_sites(self, limit=10):
+        with self._lock:
+            totals = [
+                (histogram.sum / histogram.count, site_id, histogram.count)
+                for (site_id, phase), histogram in self.site_phases.items()
+                if phase == "total" and histogram.count
+            ]
+            site_bytes = dict(self.site_bytes)
+        totals.sort(reverse=True)
+        return [
+            {"site_id": site_id, "checks": count, "mean_ms": 1000 * mean, "bytes": site_bytes.get(site_id, 0)}
+            for mean, site_id, count in totals[:limit]
+        ]
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            lines.append("# HELP website_check_phase_seconds Time spent in each phase of a check, all sites")
+            lines.append("# TYPE website_check_phase_seconds histogram")
+            for phase, histogram in sorted(self.phases.items()):
+                _histogram_lines(lines, "website_check_phase_seconds", f'phase="{phase}"', histogram)
+            lines.append("# HELP website_site_phase_seconds Time spent in each phase of a check, per site")
+            lines.append("# TYPE website_site_phase_seconds histogram")
+            for (site_id, phase), histogram in sorted(self.site_phases.items()):
+                _histogram_lines(lines, "website_site_phase_seconds", f'site="{site_id}",phase="{phase}"', histogram)
+            _counter_lines(lines, "website_checks_total", "Checks by outcome", "status", self.checks)
+            _counter_lines(lines, "website_http_responses_total", "HTTP responses by status code", "code", self.responses)
+            _counter_lines(lines, "website_check_errors_total", "Failed checks by error type", "type", self.errors)
+            _counter_lines(lines, "website_response_bytes_total", "Response bytes read, per site", "site", self.site_bytes)
+        return "\n".join(lines) + "\n"
+
+def _histogram_lines(lines, name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+def _counter_lines(lines, name, description, label, values):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} counter")
+    for key, value in sorted(values.items(), key=lambda item: str(item[0])):
+        lines.append(f'{name}{{{label}="{key}"}} {value}')
+
+
+registry = Registry()
+_local = threading.local()
+
+# Start timing a check on the current thread
+def start_check(site_id):
+    timer = CheckTimer(site_id) if METRICS_ENABLED else _NULL_TIMER
+    _local.timer = timer
+    return timer
+
+# Record the timings of the check started on the current thread
+def finish_check(timer, status, error=None):
+    _local.timer = None
+    if timer is not _NULL_TIMER:
+        registry.record_check(timer, status, error)
+
+# The timer of the check running on the current thread, if any
+def current_check():
+    return getattr(_local, "timer", None) or _NULL_TIMER
+
+# Time work outside a check, e.g. persisting a sweep or delivering notifications
+@contextmanager
+def timed(phase, site_id=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if METRICS_ENABLED:
+            registry.observe(phase, time.perf_counter() - started, site_id)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Serve /metrics for Prometheus on a background thread
+def serve_metrics(port, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
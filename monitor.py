@@ -0,0 +1,79 @@
+import hashlib
+
+import snapshots
+import store
+from adaptive import backing_off
+from checker import check_all_sites, run_check
+from metrics import timed
+from profiling import profile_cycle
+
+# Operations on the monitored websites, without any Streamlit dependency.
+# Shared by the web UI (main.py) and the command line (cli.py).
+
+# Build the record of a new (or re-added) website
+def new_website(url, name, interval, active, monitor_type="any_change", selector="", adaptive=False):
+    return {
+        "id": hashlib.md5(url.encode()).hexdigest()[:8],
+        "url": url,
+        "name": name,
+        "interval": interval,
+        "adaptive": adaptive,  # Learn the interval from how often the page changes, starting at `interval`
+        "effective_interval": None,
+        "mean_change_gap": None,
+        "observed_since": None,
+        "active": active,
+        "monitor_type": monitor_type,  # "any_change" or "stwdo_rooms"
+        "selector": (selector or "").strip() or None,  # Optional CSS selector / XPath limiting the monitored region
+        "last_checked": None,
+        "last_changed": None,
+        "current_hash": None,
+        "hash_algorithm": None,
+        "fingerprint": None,
+        "etag": None,
+        "last_modified": None,
+        "previous_rooms": [],
+        "first_scan_completed": False,
+        "consecutive_failures": 0,  # Failed checks in a row, they back off (see adaptive.py)
+        "last_failed": None
+    }
+
+# Delete a website with everything stored about it
+def delete_website(site_id):
+    store.delete_website(site_id)
+    snapshots.delete_snapshots(site_id)
+
+# Check websites once, concurrently, and store the outcome in one transaction.
+# Failing websites are left out until their backoff passed, unless retry_failing is set.
+def sweep(active_only=True, retry_failing=False, **options):
+    sites = [
+        site for site in store.read_websites(with_listings=True)
+        if (site.get("active") or not active_only) and (retry_failing or not backing_off(site))
+    ]
+    with profile_cycle("sweep", all_threads=True):
+        results = check_all_sites(sites, **options)
+        with timed("persist"):
+            store.update_websites(sites, results)
+    return results
+
+# Check a single stored website. Returns None when there is no such website.
+def check_stored_site(site_id, **options):
+    site = store.get_website(site_id)
+    if site is None:
+        return None
+    with profile_cycle("check", site_id):
+        result = run_check(site, **options)
+        with timed("persist", site_id):
+            store.update_website(site, result)
+    return result
+
+# JSON-serializable summary of a check result
+def result_summary(result):
+    summary = {key: result.get(key) for key in ("site_id", "url", "checked_at", "status", "changed", "error")}
+    change = result.get("change") or {}
+    if change.get("new_rooms"):
+        summary["new_rooms"] = [room["content"] for room in change["new_rooms"]]
+    if change.get("changed_regions"):
+        summary["changed_regions"] = [[start, end] for start, end, _ in change["changed_regions"]]
+    if change.get("snapshot_version") is not None:
+        summary["snapshot_version"] = change["snapshot_version"]
+    return summary
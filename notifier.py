@@ -0,0 +1,232 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+
+from metrics import timed
+from sessions import get_session
+
+# Load environment variables
+load_dotenv()
+EMAIL_SENDER = os.getenv("EMAIL_SENDER", "")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")
+EMAIL_RECEIVER = os.getenv("EMAIL_RECEIVER", "")
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
+TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
+
+# Delivery endpoints, overridable to point at a local SMTP/HTTP stand-in
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "true").lower() in ("1", "true", "yes")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Messages arriving within NOTIFY_BATCH_WINDOW seconds of each other are sent together
+NOTIFY_BATCH_WINDOW = float(os.getenv("NOTIFY_BATCH_WINDOW", "2"))
+NOTIFY_MAX_BATCH = int(os.getenv("NOTIFY_MAX_BATCH", "20"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "5"))
+NOTIFY_RETRY_DELAY = float(os.getenv("NOTIFY_RETRY_DELAY", "2"))
+# The SMTP connection is closed after this many idle seconds
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+NOTIFY_TIMEOUT = 10
+
+TELEGRAM_MAX_LENGTH = 4096
+
+def email_configured():
+    return bool(EMAIL_SENDER and EMAIL_PASSWORD and EMAIL_RECEIVER)
+
+def telegram_configured():
+    return bool(TELEGRAM_TOKEN and TELEGRAM_CHAT_ID)
+
+# Format a single notification the way it appears in an email or Telegram message
+def format_notification(notification):
+    return (f"{notification['message']}\n\nWebsite: {notification['site_name']}\n"
+            f"URL: {notification['url']}\nTime: {notification['time']}")
+
+
+# A queue of one delivery channel, drained by its own worker thread.
+# Messages are batched, delivered with retries and exponential backoff.
+class _Channel:
+    def __init__(self, name, deliver, idle=None):
+        self.name = name
+        self._deliver = deliver
+        self._idle = idle
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, notification):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"notify-{self.name}", daemon=True)
+                self._thread.start()
+        self._queue.put(notification)
+
+    # Block until everything queued so far was delivered or given up on
+    def join(self):
+        self._queue.join()
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=SMTP_IDLE_TIMEOUT if self._idle else None)
+        except queue.Empty:
+            self._idle()
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + NOTIFY_BATCH_WINDOW
+        while len(batch) < NOTIFY_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                for attempt in range(NOTIFY_MAX_RETRIES + 1):
+                    try:
+                        with timed(f"notify_{self.name.lower()}"):
+                            self._deliver(batch)
+                        break
+                    except Exception as e:
+                        if attempt == NOTIFY_MAX_RETRIES:
+                            print(f"{self.name} error: giving up on {len(batch)} notification(s): {e}")
+                        else:
+                            delay = NOTIFY_RETRY_DELAY * 2 ** attempt
+                            print(f"{self.name} error: {e}, retrying in {delay:g}s")
+                            time.sleep(delay)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+# Notification outbox. Checks enqueue and move on; worker threads deliver
+# emails over one reused, authenticated SMTP connection and Telegram
+# messages over the shared HTTP session.
+class NotificationOutbox:
+    def __init__(self):
+        self._smtp = None
+        self._email = _Channel("Email", self._send_emails, idle=self._close_smtp)
+        self._telegram = _Channel("Telegram", self._send_telegram)
+
+    def enqueue(self, url, site_name, message="", enable_email=True, enable_telegram=True):
+        notification = {
+            "url": url,
+            "site_name": site_name,
+            "message": message,
+            "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        queued = False
+        if enable_email and email_configured():
+            self._email.put(notification)
+            queued = True
+        if enable_telegram and telegram_configured():
+            self._telegram.put(notification)
+            queued = True
+        return queued
+
+    # Wait until all queued notifications were handled, e.g. before a one-shot process exits
+    def flush(self):
+        self._email.join()
+        self._telegram.join()
+
+    # smtplib and the email package are only imported once an email is sent
+    def _connect_smtp(self):
+        import smtplib
+
+        if SMTP_USE_SSL:
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=NOTIFY_TIMEOUT)
+            server.ehlo()
+        else:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=NOTIFY_TIMEOUT)
+            server.ehlo()
+            if server.has_extn("starttls"):
+                server.starttls()
+                server.ehlo()
+        # Credentials are always configured when emails are queued, log in with them
+        if EMAIL_SENDER and EMAIL_PASSWORD:
+            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
+        return server
+
+    def _close_smtp(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+    def _send_emails(self, batch):
+        import smtplib
+        from email.mime.text import MIMEText
+
+        if len(batch) == 1:
+            subject = "🔔 Website Change Detected"
+            body = format_notification(batch[0])
+        else:
+            subject = f"🔔 {len(batch)} Website Changes Detected"
+            body = "\n\n----------\n\n".join(format_notification(notification) for notification in batch)
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = EMAIL_SENDER
+        msg["To"] = EMAIL_RECEIVER
+
+        if self._smtp is None:
+            self._smtp = self._connect_smtp()
+        try:
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # The kept-alive connection went away or the message was refused,
+            # close it and reconnect on the next attempt
+            self._smtp.close()
+            self._smtp = None
+            raise
+
+    def _send_telegram(self, batch):
+        # Combine the batch into as few messages as Telegram's length limit allows.
+        # Notifications already sent in an earlier attempt of the batch are skipped.
+        groups = []
+        for notification in batch:
+            if notification.get("telegram_sent"):
+                continue
+            text = f"🔔 {format_notification(notification)}"
+            if groups and len(groups[-1][0]) + len(text) + 2 <= TELEGRAM_MAX_LENGTH:
+                groups[-1][0] += "\n\n" + text
+                groups[-1][1].append(notification)
+            else:
+                groups.append([text[:TELEGRAM_MAX_LENGTH], [notification]])
+
+        for text, notifications in groups:
+            response = get_session().post(
+                f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage",
+                data={"chat_id": TELEGRAM_CHAT_ID, "text": text},
+                timeout=NOTIFY_TIMEOUT,
+            )
+            response.raise_for_status()
+            for notification in notifications:
+                notification["telegram_sent"] = True
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+# Process-wide notification outbox
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = NotificationOutbox()
+        return _outbox
+
+# Queue a change notification on the enabled channels
+def notify(url, site_name, message="", enable_email=True, enable_telegram=True):
+    return get_outbox().enqueue(url, site_name, message, enable_email, enable_telegram)
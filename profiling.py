@@ -0,0 +1,166 @@
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+# Opt-in profiling of check cycles (a sweep over all sites, or a single
+# scheduled check). One cycle in PROFILE_EVERY is profiled: a background thread
+# samples the stacks of the checking threads every PROFILE_INTERVAL seconds,
+# and tracemalloc records where memory was allocated meanwhile. Each profiled
+# cycle leaves, in PROFILE_DIR:
+#   <cycle>.collapsed      stacks in the collapsed format read by flamegraph.pl,
+#                          speedscope and similar tools
+#   <cycle>.memory.txt     the lines that allocated the most during the cycle
+#   <cycle>.tracemalloc    the tracemalloc snapshot, for tracemalloc.Snapshot.load()
+# Only the newest PROFILE_KEEP cycles are kept. Only one cycle is profiled at
+# a time, so the overhead stays bounded under load.
+PROFILING_ENABLED = os.getenv("PROFILE", "false").lower() in ("1", "true", "yes")
+PROFILE_EVERY = max(1, int(os.getenv("PROFILE_EVERY", "10")))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+# tracemalloc slows allocations down noticeably, it can be left off
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "true").lower() in ("1", "true", "yes")
+PROFILE_MEMORY_FRAMES = int(os.getenv("PROFILE_MEMORY_FRAMES", "10"))
+PROFILE_MEMORY_TOP = 30
+
+PROFILE_SUFFIXES = (".collapsed", ".memory.txt", ".tracemalloc")
+
+
+def _frame_name(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+# Pool threads are numbered ("ThreadPoolExecutor-0_3"), their stacks are merged
+def _thread_root(thread_id, names):
+    return re.sub(r"_\d+$", "", names.get(thread_id, str(thread_id)))
+
+
+# Samples the stacks of some or all threads until stopped
+class _StackSampler:
+    def __init__(self, thread_id=None):
+        self.thread_id = thread_id  # None samples every thread
+        self.stacks = {}            # collapsed stack -> samples
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(PROFILE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_id is not None and thread_id != self.thread_id):
+                    continue
+                names_in_stack = []
+                while frame is not None:
+                    names_in_stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                names_in_stack.append(_thread_root(thread_id, names))
+                stack = ";".join(reversed(names_in_stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+
+class CycleProfiler:
+    def __init__(self):
+        self.enabled = PROFILING_ENABLED  # Can be switched at runtime, e.g. from the UI
+        self._counts = {}                 # cycle kind -> cycles seen
+        self._active = False
+        self._lock = threading.Lock()
+
+    # Whether this cycle of the given kind is profiled
+    def _claim(self, kind):
+        with self._lock:
+            count = self._counts.get(kind, 0)
+            self._counts[kind] = count + 1
+            if self._active or count % PROFILE_EVERY:
+                return False
+            self._active = True
+            return True
+
+    # Wrap one check cycle. kind is "sweep" or "check", detail e.g. the site ID.
+    # A sweep runs on a thread pool, so all threads are sampled for it.
+    @contextmanager
+    def cycle(self, kind, detail=None, all_threads=False):
+        if not self.enabled or not self._claim(kind):
+            yield
+            return
+
+        sampler = _StackSampler(None if all_threads else threading.get_ident())
+        started_tracing = PROFILE_MEMORY and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(PROFILE_MEMORY_FRAMES)
+        before = tracemalloc.take_snapshot() if PROFILE_MEMORY else None
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            seconds = time.perf_counter() - started
+            after = tracemalloc.take_snapshot() if PROFILE_MEMORY else None
+            peak = tracemalloc.get_traced_memory()[1] if PROFILE_MEMORY else None
+            if started_tracing:
+                tracemalloc.stop()
+            try:
+                self._write(kind, detail, seconds, sampler, before, after, peak)
+            except OSError as e:
+                print(f"Profile error: {e}")
+            with self._lock:
+                self._active = False
+
+    def _write(self, kind, detail, seconds, sampler, before, after, peak):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = "-".join(part for part in (
+            datetime.now().strftime('%Y%m%d-%H%M%S-%f'), str(os.getpid()), kind, detail
+        ) if part)
+        path = os.path.join(PROFILE_DIR, name)
+
+        with open(path + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in sorted(sampler.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        if after is not None:
+            after.dump(path + ".tracemalloc")
+            # Leave out what the profiler itself allocated
+            own = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+            growth = after.filter_traces(own).compare_to(before.filter_traces(own), "lineno")
+            with open(path + ".memory.txt", "w", encoding="utf-8") as f:
+                f.write(f"{' '.join(filter(None, (kind, detail)))} took {seconds:.3f} s, {sampler.samples} samples, "
+                        f"peak traced memory {peak / 1024:.0f} KiB\n\n")
+                for stat in growth[:PROFILE_MEMORY_TOP]:
+                    f.write(f"{stat}\n")
+        _rotate_profiles()
+
+# Keep the files of the newest PROFILE_KEEP profiled cycles
+def _rotate_profiles():
+    cycles = {}
+    for entry in os.scandir(PROFILE_DIR):
+        for suffix in PROFILE_SUFFIXES:
+            if entry.name.endswith(suffix):
+                cycle = entry.name[:-len(suffix)]
+                cycles[cycle] = max(cycles.get(cycle, 0), entry.stat().st_mtime)
+    for cycle in sorted(cycles, key=cycles.get, reverse=True)[PROFILE_KEEP:]:
+        for suffix in PROFILE_SUFFIXES:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, cycle + suffix))
+            except FileNotFoundError:
+                pass
+
+
+profiler = CycleProfiler()
+
+def profile_cycle(kind, detail=None, all_threads=False):
+    return profiler.cycle(kind, detail, all_threads)
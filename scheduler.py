@@ -0,0 +1,180 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import store
+from adaptive import next_check_interval, site_interval
+from checker import MAX_CONCURRENT_CHECKS, dispatch_check, run_check
+from metrics import timed
+from profiling import profile_cycle
+
+# How often the scheduler looks for added, edited or deleted websites
+SCHEDULER_REFRESH_SECONDS = float(os.getenv("SCHEDULER_REFRESH_SECONDS", "5"))
+# Each run is moved by up to this fraction of the interval, so sites with equal
+# intervals don't drift back into step
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", "0.1"))
+
+def jittered_interval(interval):
+    return interval * random.uniform(1 - SCHEDULE_JITTER, 1 + SCHEDULE_JITTER)
+
+
+# Long-lived background scheduler. Keeps a priority queue of (next due time, site)
+# for every active website and dispatches due checks to a thread pool, so all
+# sites are monitored on their own interval independent of any browser session.
+# Start times are randomized so sites sharing an interval spread across it.
+class MonitorScheduler:
+    def __init__(self, max_workers=MAX_CONCURRENT_CHECKS, on_result=None):
+        self._on_result = on_result  # Called with every check result, e.g. to log it
+        self._heap = []
+        self._sequence = itertools.count()
+        self._intervals = {}      # site_id -> interval for every scheduled site
+        self._urls = {}           # site_id -> URL, checks are dispatched per host
+        self._generations = {}    # site_id -> generation, stale heap entries are skipped
+        self._in_flight = set()
+        self._status = {}         # site_id -> status shown in the UI
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._store_version = object()
+        self._next_refresh = 0
+        self._thread = None
+        self.running = False
+        self.options = {
+            "skip_ssl_verification": False,
+            "enable_email": True,
+            "enable_telegram": True,
+        }
+
+    # Start (or resume) monitoring all active websites
+    def start(self, **options):
+        with self._condition:
+            self.options.update(options)
+            self.running = True
+            self._next_refresh = 0
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="monitor-scheduler", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    # Pause monitoring. Checks already in flight are allowed to finish.
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+
+    # Read-only view of the schedule for the UI
+    def snapshot(self):
+        with self._condition:
+            now = time.monotonic()
+            snapshot = {}
+            for site_id, status in self._status.items():
+                snapshot[site_id] = dict(status, due_in=max(0, status["next_due"] - now))
+            return snapshot
+
+    # Pick up added, edited and deleted websites from the store
+    def _refresh_sites(self, now):
+        version = store.store_version()
+        if version == self._store_version:
+            return
+        self._store_version = version
+
+        sites = [site for site in store.read_websites() if site.get("active")]
+        self._urls = {site["id"]: site["url"] for site in sites}
+        active = {site["id"]: site_interval(site) for site in sites}
+        for site_id in list(self._intervals):
+            if site_id not in active:
+                del self._intervals[site_id]
+                self._generations.pop(site_id, None)
+                self._status.pop(site_id, None)
+        for site_id, interval in active.items():
+            if self._intervals.get(site_id) == interval:
+                continue
+            is_new = site_id not in self._intervals
+            self._intervals[site_id] = interval
+            if site_id in self._in_flight:
+                continue  # Rescheduled with the new interval once the check completes
+            # New sites start at a random phase within their interval instead of all at once
+            due = now + random.uniform(0, interval) if is_new else self._status[site_id]["last_run"] + interval
+            self._schedule(site_id, max(due, now))
+
+    def _schedule(self, site_id, due):
+        generation = self._generations.get(site_id, 0) + 1
+        self._generations[site_id] = generation
+        heapq.heappush(self._heap, (due, next(self._sequence), site_id, generation))
+        status = self._status.setdefault(site_id, {"last_run": 0, "last_result": None, "last_error": None})
+        status["next_due"] = due
+        status["state"] = "scheduled"
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                if now >= self._next_refresh:
+                    try:
+                        self._refresh_sites(now)
+                    except Exception as e:
+                        print(f"Scheduler error reading websites: {e}")
+                    self._next_refresh = now + SCHEDULER_REFRESH_SECONDS
+
+                due_sites = []
+                while self.running and self._heap and self._heap[0][0] <= now:
+                    _, _, site_id, generation = heapq.heappop(self._heap)
+                    if self._generations.get(site_id) != generation:
+                        continue
+                    self._in_flight.add(site_id)
+                    self._status[site_id]["state"] = "checking"
+                    due_sites.append(site_id)
+
+                options = dict(self.options)
+                urls = {site_id: self._urls[site_id] for site_id in due_sites}
+                timeout = self._next_refresh - now
+                if self.running and self._heap:
+                    timeout = min(timeout, self._heap[0][0] - now)
+                if not due_sites:
+                    self._condition.wait(max(timeout, 0))
+                    continue
+
+            for site_id in due_sites:
+                dispatch_check(self._executor, urls[site_id], partial(self._check, site_id, options))
+
+    def _check(self, site_id, options, throttle_wait=None):
+        started = time.monotonic()
+        result = None
+        error = None
+        interval = None
+        delay = None
+        try:
+            site = store.get_website(site_id)
+            if site is not None and site.get("active"):
+                with profile_cycle("check", site_id):
+                    check_result = run_check(site, throttle_wait, **options)
+                    with timed("persist", site_id):
+                        store.update_website(site, check_result)
+                if self._on_result is not None:
+                    self._on_result(check_result)
+                result = check_result["status"]
+                error = check_result["error"]
+                interval = site_interval(site)  # Adaptive sites may have a new interval
+                delay = next_check_interval(site)  # Failing sites back off
+        except Exception as e:
+            print(f"Error checking {site_id}: {e}")
+            error = str(e)
+        finally:
+            with self._condition:
+                self._in_flight.discard(site_id)
+                status = self._status.get(site_id)
+                if status is not None:
+                    status["last_run"] = started
+                    status["last_checked"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    status["last_result"] = result if error is None or result == "skipped" else "error"
+                    status["last_error"] = error
+                if site_id in self._intervals:
+                    if interval is not None:
+                        self._intervals[site_id] = interval
+                    self._schedule(site_id, started + jittered_interval(delay or self._intervals[site_id]))
+                self._condition.notify()
@@ -0,0 +1,198 @@
+import re
+from html.parser import HTMLParser
+
+from metrics import current_check
+from streaming import body_decoder, iter_body, read_text
+
+# Scoped monitoring: only the parts of a page matching a site's selector are hashed
+# or handed to room extraction. Simple selectors (tag, #id, .class and
+# combinations like div#main.listing) are matched by an incremental parser; for
+# an #id it stops reading the page once that element is closed. Anything else is
+# treated as a CSS selector for BeautifulSoup, or as XPath (lxml) when it starts
+# with "/" or "(". A selector that matches nothing fails the check.
+
+SIMPLE_SELECTOR_PATTERN = re.compile(r'^([a-zA-Z][a-zA-Z0-9-]*)?((?:[#.][\w-]+)*)$')
+
+# Elements that never have an end tag
+VOID_ELEMENTS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+])
+
+# Raised when a page has no element matching the site's selector
+class SelectorNotFoundError(Exception):
+    pass
+
+
+def is_xpath(selector):
+    return selector.startswith("/") or selector.startswith("(")
+
+# Split a simple selector into (tag, id, classes), or None if it needs a full parser
+def parse_simple_selector(selector):
+    selector = selector.strip()
+    match = SIMPLE_SELECTOR_PATTERN.match(selector)
+    if not selector or not match:
+        return None
+    tag = match.group(1).lower() if match.group(1) else None
+    element_id = None
+    classes = set()
+    for part in re.findall(r'[#.][\w-]+', match.group(2)):
+        if part[0] == "#":
+            if element_id is not None:
+                return None
+            element_id = part[1:]
+        else:
+            classes.add(part[1:])
+    return tag, element_id, classes
+
+# Raise ValueError for a selector that can't be used, e.g. before it is saved
+def validate_selector(selector):
+    selector = (selector or "").strip()
+    if not selector or parse_simple_selector(selector) is not None:
+        return
+    if is_xpath(selector):
+        try:
+            from lxml import etree
+        except ImportError:
+            raise ValueError("XPath selectors need the lxml package, use a CSS selector instead")
+        try:
+            etree.XPath(selector)
+        except etree.XPathSyntaxError as e:
+            raise ValueError(f"Invalid XPath: {e}")
+        return
+
+    try:
+        import soupsieve
+    except ImportError:
+        raise ValueError("CSS selectors need the beautifulsoup4 package")
+    try:
+        soupsieve.compile(selector)
+    except soupsieve.SelectorSyntaxError as e:
+        raise ValueError(f"Invalid CSS selector: {e}")
+
+
+# Incremental parser that captures the markup of every element matching a simple
+# selector (matches nested in a captured element are part of it). An id is unique,
+# so with one `done` turns True as soon as its element is closed.
+class RegionParser(HTMLParser):
+    def __init__(self, simple_selector):
+        super().__init__(convert_charrefs=False)
+        self.tag, self.element_id, self.classes = simple_selector
+        self.parts = []
+        self.stack = []
+        self.matches = 0
+        self.done = False
+
+    def _matches(self, tag, attrs):
+        if self.tag and tag != self.tag:
+            return False
+        attributes = dict(attrs)
+        if self.element_id and attributes.get("id") != self.element_id:
+            return False
+        if self.classes and not self.classes.issubset((attributes.get("class") or "").split()):
+            return False
+        return True
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if not self.stack:
+            if not self._matches(tag, attrs):
+                return
+            self.matches += 1
+        self.parts.append(self.get_starttag_text())
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+        elif not self.stack:
+            self._element_closed()  # The match is a single void element
+
+    def handle_startendtag(self, tag, attrs):
+        if self.done:
+            return
+        if self.stack:
+            self.parts.append(self.get_starttag_text())
+        elif self._matches(tag, attrs):
+            self.matches += 1
+            self.parts.append(self.get_starttag_text())
+            self._element_closed()
+
+    def handle_endtag(self, tag):
+        if self.done or not self.stack or tag not in self.stack:
+            return
+        # Implicitly close anything left open inside the element
+        while self.stack:
+            self.parts.append(f"</{self.stack[-1]}>")
+            if self.stack.pop() == tag:
+                break
+        if not self.stack:
+            self._element_closed()
+
+    def _element_closed(self):
+        if self.element_id:
+            self.done = True
+
+    def handle_data(self, data):
+        if self.stack and not self.done:
+            self.parts.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+    def handle_comment(self, data):
+        self.handle_data(f"<!--{data}-->")
+
+    def region(self):
+        return "".join(self.parts)
+
+# Read a streamed response and return the markup matching a simple selector.
+# For an #id the rest of the page after its element is never downloaded.
+def stream_region(response, simple_selector):
+    decoder = body_decoder(response)
+    parser = RegionParser(simple_selector)
+    timer = current_check()
+    chunks = iter_body(response)
+    try:
+        for chunk in chunks:
+            with timer.phase("decode"):
+                parser.feed(decoder.decode(chunk))
+            if parser.done:
+                break
+        else:
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+    finally:
+        chunks.close()
+    if not parser.matches:
+        raise SelectorNotFoundError("Selector matched nothing on the page")
+    return parser.region()
+
+# Select the regions from an already downloaded page
+def select_region(content, selector):
+    if is_xpath(selector):
+        import lxml.html
+        document = lxml.html.fromstring(content)
+        nodes = document.xpath(selector)
+        if not isinstance(nodes, list):
+            nodes = [nodes]  # XPath functions like string() or count() return a single value
+        parts = [lxml.html.tostring(node, encoding="unicode") if hasattr(node, "tag") else str(node) for node in nodes]
+    else:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(content, "html.parser")
+        parts = [str(element) for element in soup.select(selector)]
+    if not parts:
+        raise SelectorNotFoundError("Selector matched nothing on the page")
+    return "".join(parts)
+
+# Content of a response restricted to the site's selector
+def read_scoped_content(response, selector):
+    if not selector:
+        return read_text(response)
+    simple_selector = parse_simple_selector(selector)
+    if simple_selector is not None:
+        return stream_region(response, simple_selector)
+    content = read_text(response)
+    with current_check().phase("extract"):
+        return select_region(content, selector)
@@ -0,0 +1,43 @@
+import os
+import threading
+
+# Connection pool sizing. urllib3 keeps one pool per host: HTTP_POOL_CONNECTIONS
+# is how many host pools are cached, HTTP_POOL_MAXSIZE how many keep-alive
+# connections each host pool holds on to.
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "64"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "8"))
+
+# Process-wide sessions, one per SSL verification setting
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# requests (and urllib3 with it) is imported on first use, not at startup
+def _build_session(verify):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.verify = verify
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Get the shared keep-alive session. Pass verify=False to honour "Skip SSL Verification".
+def get_session(verify=True):
+    with _sessions_lock:
+        session = _sessions.get(verify)
+        if session is None:
+            if not verify:
+                import urllib3
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+            session = _build_session(verify)
+            _sessions[verify] = session
+        return session
+
+# Close all pooled connections, e.g. on shutdown
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,287 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+# Snapshot archive: the page (or selected region) is kept for every baseline and
+# detected change. Blobs are compressed and stored once per content hash, no matter
+# how many sites or versions refer to them. It lives in its own database so that
+# archiving never bumps the website store's version.
+SNAPSHOTS_ENABLED = os.getenv("SNAPSHOTS", "true").lower() in ("1", "true", "yes")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshots.db")
+
+# Retention per site: the newest SNAPSHOT_MAX_VERSIONS versions, and no more than
+# SNAPSHOT_SITE_MAX_BYTES of compressed blobs. The latest version is always kept.
+SNAPSHOT_MAX_VERSIONS = int(os.getenv("SNAPSHOT_MAX_VERSIONS", "20"))
+SNAPSHOT_SITE_MAX_BYTES = int(os.getenv("SNAPSHOT_SITE_MAX_BYTES", str(5 * 1024 * 1024)))
+# Across all sites, least recently used blobs are evicted beyond this size
+SNAPSHOT_MAX_TOTAL_BYTES = int(os.getenv("SNAPSHOT_MAX_TOTAL_BYTES", str(256 * 1024 * 1024)))
+# Larger pages are not archived
+SNAPSHOT_MAX_BLOB_BYTES = int(os.getenv("SNAPSHOT_MAX_BLOB_BYTES", str(2 * 1024 * 1024)))
+# Page bodies are buffered in memory up to this size while checking, and in a temporary file beyond
+SNAPSHOT_SPOOL_BYTES = int(os.getenv("SNAPSHOT_SPOOL_BYTES", str(64 * 1024)))
+
+# "auto" uses zstd when available (Python 3.14+ or the backports.zstd package), zlib otherwise
+SNAPSHOT_COMPRESSION = os.getenv("SNAPSHOT_COMPRESSION", "auto")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access);
+CREATE TABLE IF NOT EXISTS versions (
+    site_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    blob_hash TEXT NOT NULL REFERENCES blobs(hash),
+    captured_at TEXT NOT NULL,
+    PRIMARY KEY (site_id, version)
+);
+CREATE INDEX IF NOT EXISTS versions_blob ON versions (blob_hash);
+"""
+
+def _zstd():
+    try:
+        from compression import zstd
+    except ImportError:
+        from backports import zstd
+    return zstd
+
+def _resolve_codec():
+    if SNAPSHOT_COMPRESSION != "auto":
+        return SNAPSHOT_COMPRESSION
+    try:
+        _zstd()
+        return "zstd"
+    except ImportError:
+        return "zlib"
+
+CODEC = _resolve_codec()
+
+def _compress(data):
+    if CODEC == "zstd":
+        return _zstd().compress(data)
+    return zlib.compress(data, 6)
+
+def _decompress(codec, data):
+    if codec == "zstd":
+        return _zstd().decompress(data)
+    return zlib.decompress(data)
+
+
+# Collects a streamed body for archiving, giving up beyond SNAPSHOT_MAX_BLOB_BYTES.
+# Bodies larger than SNAPSHOT_SPOOL_BYTES are spooled to a temporary file, so a
+# check holds no more than that in memory unless it reads the body back with `data`.
+class SnapshotBuffer:
+    def __init__(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SNAPSHOT_SPOOL_BYTES)
+        self._size = 0
+        self.overflowed = False
+
+    def update(self, chunk):
+        if self.overflowed:
+            return
+        self._size += len(chunk)
+        if self._size > SNAPSHOT_MAX_BLOB_BYTES:
+            self.overflowed = True
+            self._file.close()
+            return
+        self._file.write(chunk)
+
+    @property
+    def data(self):
+        if self.overflowed:
+            return None
+        self._file.seek(0)
+        return self._file.read()
+
+    def close(self):
+        self._file.close()
+
+
+# One connection per thread, the schema is set up once per process
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+def _connect():
+    connection = getattr(_local, "connection", None)
+    if connection is not None and _local.path == SNAPSHOT_PATH:
+        return connection
+
+    connection = sqlite3.connect(SNAPSHOT_PATH, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    # Freed pages of evicted blobs are returned to the file system. The mode has
+    # to be set before journal_mode=WAL creates the database file.
+    connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    _local.connection = connection
+    _local.path = SNAPSHOT_PATH
+
+    with _init_lock:
+        if SNAPSHOT_PATH not in _initialized:
+            # Archives created without it are converted once, which takes a VACUUM
+            if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                connection.execute("VACUUM")
+            connection.executescript(SCHEMA)
+            _initialized.add(SNAPSHOT_PATH)
+    return connection
+
+@contextmanager
+def _transaction():
+    connection = _connect()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+def _delete_versions(connection, site_id, versions):
+    connection.executemany(
+        "DELETE FROM versions WHERE site_id = ? AND version = ?",
+        [(site_id, version) for version in versions],
+    )
+
+# Drop blobs that no version refers to any more
+def _delete_orphans(connection, hashes):
+    connection.executemany(
+        "DELETE FROM blobs WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM versions WHERE blob_hash = ?)",
+        [(blob_hash, blob_hash) for blob_hash in hashes],
+    )
+
+# Keep the newest versions of a site within the count and size limits
+def _apply_site_retention(connection, site_id):
+    rows = connection.execute(
+        "SELECT v.version, v.blob_hash, b.stored_size FROM versions v JOIN blobs b ON b.hash = v.blob_hash "
+        "WHERE v.site_id = ? ORDER BY v.version DESC",
+        (site_id,),
+    ).fetchall()
+
+    kept_blobs = set()
+    total = 0
+    expired = []
+    for index, row in enumerate(rows):
+        new_blob = row["blob_hash"] not in kept_blobs
+        size = row["stored_size"] if new_blob else 0
+        if index > 0 and (index >= SNAPSHOT_MAX_VERSIONS or total + size > SNAPSHOT_SITE_MAX_BYTES):
+            expired.append(row)
+            continue
+        kept_blobs.add(row["blob_hash"])
+        total += size
+
+    _delete_versions(connection, site_id, [row["version"] for row in expired])
+    _delete_orphans(connection, {row["blob_hash"] for row in expired})
+
+# Evict least recently used blobs, with all versions pointing at them, until the
+# archive fits into SNAPSHOT_MAX_TOTAL_BYTES
+def _apply_total_limit(connection, keep_hash):
+    total = connection.execute("SELECT COALESCE(SUM(stored_size), 0) FROM blobs").fetchone()[0]
+    if total <= SNAPSHOT_MAX_TOTAL_BYTES:
+        return
+    rows = connection.execute(
+        "SELECT hash, stored_size FROM blobs WHERE hash != ? ORDER BY last_access", (keep_hash,)
+    )
+    evicted = []
+    for row in rows:
+        if total <= SNAPSHOT_MAX_TOTAL_BYTES:
+            break
+        evicted.append(row["hash"])
+        total -= row["stored_size"]
+    connection.executemany("DELETE FROM versions WHERE blob_hash = ?", [(blob_hash,) for blob_hash in evicted])
+    connection.executemany("DELETE FROM blobs WHERE hash = ?", [(blob_hash,) for blob_hash in evicted])
+
+# Archive a page of a site. Returns the version number, which stays the same when
+# the content equals the site's latest version.
+def save_snapshot(site_id, data, captured_at=None):
+    blob_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+    captured_at = captured_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    connection = _connect()
+
+    # Compress outside the write lock, and only content that isn't stored yet
+    compressed = None
+    if connection.execute("SELECT 1 FROM blobs WHERE hash = ?", (blob_hash,)).fetchone() is None:
+        compressed = _compress(data)
+
+    with _transaction() as connection:
+        latest = connection.execute(
+            "SELECT version, blob_hash FROM versions WHERE site_id = ? ORDER BY version DESC LIMIT 1", (site_id,)
+        ).fetchone()
+        if connection.execute("SELECT 1 FROM blobs WHERE hash = ?", (blob_hash,)).fetchone() is None:
+            if compressed is None:
+                compressed = _compress(data)  # Evicted in the meantime
+            connection.execute(
+                "INSERT INTO blobs (hash, codec, size, stored_size, last_access, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (blob_hash, CODEC, len(data), len(compressed), time.time(), compressed),
+            )
+        else:
+            connection.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (time.time(), blob_hash))
+
+        if latest is not None and latest["blob_hash"] == blob_hash:
+            return latest["version"]
+        version = latest["version"] + 1 if latest is not None else 1
+        connection.execute(
+            "INSERT INTO versions (site_id, version, blob_hash, captured_at) VALUES (?, ?, ?, ?)",
+            (site_id, version, blob_hash, captured_at),
+        )
+        _apply_site_retention(connection, site_id)
+        _apply_total_limit(connection, blob_hash)
+    connection.execute("PRAGMA incremental_vacuum")
+    return version
+
+# Archived versions of a site, newest first, without their content
+def list_snapshots(site_id):
+    rows = _connect().execute(
+        "SELECT v.version, v.captured_at, b.size, b.stored_size, v.blob_hash FROM versions v "
+        "JOIN blobs b ON b.hash = v.blob_hash WHERE v.site_id = ? ORDER BY v.version DESC",
+        (site_id,),
+    )
+    return [dict(row) for row in rows]
+
+# Version k of a site, or its latest version. Negative k counts back from the latest.
+# Returns None when that version isn't archived (any more).
+def read_snapshot(site_id, version=None):
+    connection = _connect()
+    if version is None or version < 0:
+        offset = 0 if version is None else -version - 1
+        row = connection.execute(
+            "SELECT version FROM versions WHERE site_id = ? ORDER BY version DESC LIMIT 1 OFFSET ?",
+            (site_id, offset),
+        ).fetchone()
+        if row is None:
+            return None
+        version = row["version"]
+
+    row = connection.execute(
+        "SELECT v.version, v.captured_at, v.blob_hash, b.codec, b.data FROM versions v "
+        "JOIN blobs b ON b.hash = v.blob_hash WHERE v.site_id = ? AND v.version = ?",
+        (site_id, version),
+    ).fetchone()
+    if row is None:
+        return None
+    connection.execute("UPDATE blobs SET last_access = ? WHERE hash = ?", (time.time(), row["blob_hash"]))
+    return {
+        "version": row["version"],
+        "captured_at": row["captured_at"],
+        "content": _decompress(row["codec"], row["data"]),
+    }
+
+# Forget all versions of a site
+def delete_snapshots(site_id):
+    with _transaction() as connection:
+        hashes = {row[0] for row in connection.execute("SELECT blob_hash FROM versions WHERE site_id = ?", (site_id,))}
+        connection.execute("DELETE FROM versions WHERE site_id = ?", (site_id,))
+        _delete_orphans(connection, hashes)
+    connection.execute("PRAGMA incremental_vacuum")
@@ -0,0 +1,521 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from adaptive import site_interval
+from extractor import listing_number
+
+STORE_PATH = os.getenv("STORE_PATH", "websites.db")
+LEGACY_WEBSITES_FILE = "websites.json"
+
+# How many check results are kept per site
+CHECK_RESULTS_RETENTION = int(os.getenv("CHECK_RESULTS_RETENTION", "100"))
+# Listings not seen for this many days are dropped from the seen index, and
+# reported as new should they ever come back
+SEEN_LISTING_MAX_AGE_DAYS = int(os.getenv("SEEN_LISTING_MAX_AGE_DAYS", "180"))
+
+# Persisted site fields (besides the id) and their column types. The configuration
+# is only written by the UI and the command line, checks write back the state.
+CONFIG_COLUMNS = {
+    "url": "TEXT NOT NULL",
+    "name": "TEXT",
+    "interval": "INTEGER",
+    "adaptive": "INTEGER",
+    "active": "INTEGER",
+    "monitor_type": "TEXT",
+    "selector": "TEXT",
+}
+STATE_COLUMNS = {
+    "effective_interval": "INTEGER",
+    "mean_change_gap": "REAL",
+    "observed_since": "TEXT",
+    "last_checked": "TEXT",
+    "last_changed": "TEXT",
+    "current_hash": "TEXT",
+    "hash_algorithm": "TEXT",
+    "etag": "TEXT",
+    "last_modified": "TEXT",
+    "first_scan_completed": "INTEGER",
+    "consecutive_failures": "INTEGER",
+    "last_failed": "TEXT",
+}
+SITE_COLUMNS = {**CONFIG_COLUMNS, **STATE_COLUMNS}
+# Configuration a check result depends on. When one of them was edited while the
+# site was checked, the outdated state isn't written back over the edit.
+CHECKED_COLUMNS = ("url", "monitor_type", "selector")
+BOOLEAN_COLUMNS = {"active", "adaptive", "first_scan_completed"}
+# Scheduling state of lease-based workers (see worker.py). Kept apart from
+# SITE_COLUMNS, so writing back a site never touches another worker's lease.
+LEASE_COLUMNS = {
+    "next_due": "REAL",        # Epoch seconds, NULL until first claimed
+    "lease_owner": "TEXT",
+    "lease_expires": "REAL",   # Epoch seconds
+    "lease_token": "INTEGER",  # Incremented on every claim, fences stale write-backs
+}
+# Columns read for a site. Columns of older versions left in the table are ignored.
+SITE_FIELDS = ", ".join(["id", *SITE_COLUMNS, *LEASE_COLUMNS])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    site_id TEXT NOT NULL REFERENCES sites(id) ON DELETE CASCADE,
+    room_id TEXT NOT NULL,
+    content TEXT,
+    full_content TEXT,
+    PRIMARY KEY (site_id, room_id)
+);
+CREATE TABLE IF NOT EXISTS seen_listings (
+    site_id TEXT NOT NULL REFERENCES sites(id) ON DELETE CASCADE,
+    listing_id INTEGER NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    PRIMARY KEY (site_id, listing_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS check_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    site_id TEXT NOT NULL REFERENCES sites(id) ON DELETE CASCADE,
+    checked_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    changed INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS check_results_site ON check_results (site_id, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    site_id TEXT PRIMARY KEY REFERENCES sites(id) ON DELETE CASCADE,
+    chunks TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    next_allowed_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# One connection per thread, the schema is set up once per process
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+def _connect():
+    connection = getattr(_local, "connection", None)
+    if connection is not None and _local.path == STORE_PATH:
+        return connection
+
+    # Autocommit mode, transactions are opened explicitly in _transaction()
+    connection = sqlite3.connect(STORE_PATH, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    _local.connection = connection
+    _local.path = STORE_PATH
+
+    with _init_lock:
+        if STORE_PATH not in _initialized:
+            _initialize(connection)
+            _initialized.add(STORE_PATH)
+    return connection
+
+# Write transaction. Unless bump_version is False, readers see the store version change.
+@contextmanager
+def _transaction(bump_version=True):
+    connection = _connect()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    if bump_version:
+        connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+    connection.execute("COMMIT")
+
+def _initialize(connection):
+    connection.executescript(SCHEMA)
+    existing = {row["name"] for row in connection.execute("PRAGMA table_info(sites)")}
+    for column, column_type in {**SITE_COLUMNS, **LEASE_COLUMNS}.items():
+        if column not in existing:
+            # SQLite cannot add NOT NULL columns without a default
+            connection.execute(f"ALTER TABLE sites ADD COLUMN {column} {column_type.replace(' NOT NULL', '')}")
+    connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+    if "fingerprint" in existing:
+        _migrate_fingerprint_column(connection)
+    _migrate_legacy_file(connection)
+    _seed_seen_listings(connection)
+
+# Fingerprints used to be stored on the site rows. They are moved into their own
+# table and the column is emptied, it is no longer read.
+def _migrate_fingerprint_column(connection):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(
+            "INSERT OR IGNORE INTO fingerprints (site_id, chunks) "
+            "SELECT id, fingerprint FROM sites WHERE fingerprint IS NOT NULL"
+        )
+        connection.execute("UPDATE sites SET fingerprint = NULL WHERE fingerprint IS NOT NULL")
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+# One-time import of websites.json from before the SQLite store existed
+def _migrate_legacy_file(connection):
+    if not os.path.exists(LEGACY_WEBSITES_FILE):
+        return
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        if connection.execute("SELECT COUNT(*) FROM sites").fetchone()[0]:
+            connection.execute("ROLLBACK")
+            return
+        with open(LEGACY_WEBSITES_FILE, "r") as f:
+            websites = json.load(f)
+        for site in websites:
+            _upsert_site(connection, site)
+            _save_rooms(connection, site)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    os.replace(LEGACY_WEBSITES_FILE, LEGACY_WEBSITES_FILE + ".migrated")
+    print(f"Migrated {len(websites)} website(s) from {LEGACY_WEBSITES_FILE} to {STORE_PATH}")
+
+# Fill the seen index from the stored rooms of sites that were scanned before it existed
+def _seed_seen_listings(connection):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        rows = connection.execute(
+            "SELECT r.site_id, r.room_id, COALESCE(s.last_checked, ?) FROM rooms r "
+            "JOIN sites s ON s.id = r.site_id "
+            "WHERE NOT EXISTS (SELECT 1 FROM seen_listings l WHERE l.site_id = r.site_id)",
+            (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),),
+        ).fetchall()
+        connection.executemany(
+            "INSERT OR IGNORE INTO seen_listings (site_id, listing_id, first_seen, last_seen) VALUES (?, ?, ?, ?)",
+            [(site_id, listing_number(room_id), seen_at, seen_at) for site_id, room_id, seen_at in rows],
+        )
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+def _site_values(site, columns=SITE_COLUMNS):
+    values = []
+    for column in columns:
+        value = site.get(column)
+        if column in BOOLEAN_COLUMNS and value is not None:
+            value = int(bool(value))
+        values.append(value)
+    return values
+
+def _row_to_site(row):
+    site = dict(row)
+    for column in BOOLEAN_COLUMNS:
+        if site.get(column) is not None:
+            site[column] = bool(site[column])
+    return site
+
+def _upsert_site(connection, site):
+    columns = ", ".join(SITE_COLUMNS)
+    placeholders = ", ".join("?" for _ in SITE_COLUMNS)
+    updates = ", ".join(f"{column} = excluded.{column}" for column in SITE_COLUMNS)
+    connection.execute(
+        f"INSERT INTO sites (id, {columns}) VALUES (?, {placeholders}) "
+        f"ON CONFLICT(id) DO UPDATE SET {updates}",
+        [site["id"]] + _site_values(site),
+    )
+
+# Write back the check state of a site row, leaving its configuration as it is
+# now. Returns False when the site was deleted or its checked configuration
+# edited in the meantime.
+def _update_site(connection, site):
+    assignments = ", ".join(f"{column} = ?" for column in STATE_COLUMNS)
+    unchanged = " AND ".join(f"{column} IS ?" for column in CHECKED_COLUMNS)
+    cursor = connection.execute(
+        f"UPDATE sites SET {assignments} WHERE id = ? AND {unchanged}",
+        _site_values(site, STATE_COLUMNS) + [site["id"]] + _site_values(site, CHECKED_COLUMNS),
+    )
+    return cursor.rowcount > 0
+
+# Release the lease of a site and schedule its next check. Returns False when the
+# lease was lost (expired and claimed by another worker) or the site was deleted.
+def _release_lease(connection, site, owner, next_due):
+    cursor = connection.execute(
+        "UPDATE sites SET next_due = ?, lease_owner = NULL, lease_expires = NULL "
+        "WHERE id = ? AND lease_owner = ? AND lease_token = ?",
+        (next_due, site["id"], owner, site["lease_token"]),
+    )
+    return cursor.rowcount > 0
+
+# Bring the stored rooms of a site in line with site["previous_rooms"], touching only changed rows
+def _save_rooms(connection, site):
+    if "previous_rooms" not in site:
+        return
+    rooms = {room["id"]: room for room in site["previous_rooms"]}
+    stored = {row[0] for row in connection.execute("SELECT room_id FROM rooms WHERE site_id = ?", (site["id"],))}
+
+    removed = stored - rooms.keys()
+    if removed:
+        connection.executemany(
+            "DELETE FROM rooms WHERE site_id = ? AND room_id = ?",
+            [(site["id"], room_id) for room_id in removed],
+        )
+    added = [rooms[room_id] for room_id in rooms.keys() - stored]
+    if added:
+        connection.executemany(
+            "INSERT INTO rooms (site_id, room_id, content, full_content) VALUES (?, ?, ?, ?)",
+            [(site["id"], room["id"], room.get("content"), room.get("full_content")) for room in added],
+        )
+
+# Record the listings of the last scan in the seen index and forget listings
+# that haven't been seen for SEEN_LISTING_MAX_AGE_DAYS. When an unchanged page
+# wasn't parsed again (rooms_unchanged), its stored rooms count as seen.
+def _save_seen_listings(connection, site):
+    if not site.get("last_checked"):
+        return
+    seen_at = site["last_checked"]
+    if site.get("previous_rooms"):
+        connection.executemany(
+            "INSERT INTO seen_listings (site_id, listing_id, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(site_id, listing_id) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)",
+            [(site["id"], listing_number(room["id"]), seen_at, seen_at) for room in site["previous_rooms"]],
+        )
+    elif site.get("rooms_unchanged"):
+        listing_ids = {listing_number(row[0]) for row in
+                       connection.execute("SELECT room_id FROM rooms WHERE site_id = ?", (site["id"],))}
+        connection.executemany(
+            "UPDATE seen_listings SET last_seen = MAX(last_seen, ?) WHERE site_id = ? AND listing_id = ?",
+            [(seen_at, site["id"], listing_id) for listing_id in listing_ids],
+        )
+    else:
+        return
+    cutoff = (datetime.now() - timedelta(days=SEEN_LISTING_MAX_AGE_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    connection.execute("DELETE FROM seen_listings WHERE site_id = ? AND last_seen < ?", (site["id"], cutoff))
+
+# Store the chunk fingerprint of a site, if the record carries one. A row is only
+# rewritten when the fingerprint changed, which most checks don't.
+def _save_fingerprint(connection, site):
+    if "fingerprint" not in site:
+        return
+    if site["fingerprint"] is None:
+        connection.execute("DELETE FROM fingerprints WHERE site_id = ?", (site["id"],))
+        return
+    connection.execute(
+        "INSERT INTO fingerprints (site_id, chunks) VALUES (?, ?) "
+        "ON CONFLICT(site_id) DO UPDATE SET chunks = excluded.chunks WHERE chunks != excluded.chunks",
+        (site["id"], json.dumps(site["fingerprint"], separators=(",", ":"))),
+    )
+
+def _load_fingerprint(connection, site_id):
+    row = connection.execute("SELECT chunks FROM fingerprints WHERE site_id = ?", (site_id,)).fetchone()
+    return None if row is None else json.loads(row[0])
+
+# What a check needs besides the site row: the seen-listing index and the chunk fingerprint
+def _load_check_state(connection, site):
+    site["seen_listings"] = _load_seen_listings(connection, site["id"])
+    site["fingerprint"] = _load_fingerprint(connection, site["id"])
+    return site
+
+def _load_seen_listings(connection, site_id):
+    return {row[0] for row in connection.execute("SELECT listing_id FROM seen_listings WHERE site_id = ?", (site_id,))}
+
+def _load_rooms(connection, site_id):
+    rows = connection.execute(
+        "SELECT room_id, content, full_content FROM rooms WHERE site_id = ? ORDER BY rowid", (site_id,)
+    )
+    return [{"id": row["room_id"], "content": row["content"], "full_content": row["full_content"]} for row in rows]
+
+def _record_check(connection, result):
+    connection.execute(
+        "INSERT INTO check_results (site_id, checked_at, status, changed, error) VALUES (?, ?, ?, ?, ?)",
+        (result["site_id"], result["checked_at"], result["status"], int(result["changed"]), result.get("error")),
+    )
+
+def _prune_check_results(connection, site_ids):
+    connection.executemany(
+        "DELETE FROM check_results WHERE site_id = ? AND id <= "
+        "(SELECT id FROM check_results WHERE site_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+        [(site_id, site_id, CHECK_RESULTS_RETENTION) for site_id in site_ids],
+    )
+
+# Read all websites. The seen-listing index and chunk fingerprint, needed to check
+# them, are only loaded when asked for.
+def read_websites(with_listings=False):
+    connection = _connect()
+    websites = [_row_to_site(row) for row in connection.execute(f"SELECT {SITE_FIELDS} FROM sites ORDER BY rowid")]
+    if with_listings:
+        for site in websites:
+            _load_check_state(connection, site)
+    return websites
+
+# Find a single website by ID, including its seen-listing index and chunk fingerprint
+def get_website(site_id):
+    connection = _connect()
+    row = connection.execute(f"SELECT {SITE_FIELDS} FROM sites WHERE id = ?", (site_id,)).fetchone()
+    if row is None:
+        return None
+    return _load_check_state(connection, _row_to_site(row))
+
+# Room listings found by the last scan of a website, with their text
+def read_rooms(site_id):
+    return _load_rooms(_connect(), site_id)
+
+# Add a website or replace its configuration and state
+def upsert_website(site):
+    with _transaction() as connection:
+        _upsert_site(connection, site)
+        _save_rooms(connection, site)
+        _save_seen_listings(connection, site)
+        _save_fingerprint(connection, site)
+
+# Delete a website together with its rooms, seen listings, fingerprint and check results
+def delete_website(site_id):
+    with _transaction() as connection:
+        connection.execute("DELETE FROM sites WHERE id = ?", (site_id,))
+
+# Write back the state of checked sites and their check results in one
+# transaction, e.g. once per sweep. Sites deleted in the meantime are not brought back.
+def update_websites(sites, results=()):
+    with _transaction() as connection:
+        existing = set()
+        for site in sites:
+            if _update_site(connection, site):
+                existing.add(site["id"])
+                _save_rooms(connection, site)
+                _save_seen_listings(connection, site)
+                _save_fingerprint(connection, site)
+        for result in results:
+            if result["site_id"] in existing:
+                _record_check(connection, result)
+        if results:
+            _prune_check_results(connection, {result["site_id"] for result in results} & existing)
+
+# Write back a single checked site
+def update_website(site, result=None):
+    update_websites([site], [result] if result else ())
+
+# Most recent check results of a site, newest first
+def read_check_results(site_id, limit=10):
+    rows = _connect().execute(
+        "SELECT checked_at, status, changed, error FROM check_results WHERE site_id = ? ORDER BY id DESC LIMIT ?",
+        (site_id, limit),
+    )
+    return [dict(row, changed=bool(row["changed"])) for row in rows]
+
+def _host_key(url):
+    return urlparse(url).hostname or url
+
+# Lease up to `limit` active websites that are due and not leased by a live worker.
+# Returns them ready to check, each with the lease_token needed to write it back.
+# The per-host limits are kept here, so they hold across all worker processes and
+# nodes sharing the store: a host has at most max_per_host leased sites, and
+# sites of a host are claimed at `rate` per second with bursts of `burst` (a
+# token bucket kept as the time its next claim is allowed, 0 disables it).
+def claim_due_sites(owner, limit, lease_seconds, max_per_host=None, rate=0, burst=1):
+    now = time.time()
+    with _transaction(bump_version=False) as connection:
+        # New sites start at a random phase within their interval instead of all
+        # at once, as in the in-process scheduler
+        unscheduled = connection.execute(
+            "SELECT id, interval, adaptive, effective_interval FROM sites WHERE active = 1 AND next_due IS NULL"
+        ).fetchall()
+        connection.executemany(
+            "UPDATE sites SET next_due = ? WHERE id = ?",
+            [(now + random.uniform(0, site_interval(_row_to_site(row))), row["id"]) for row in unscheduled],
+        )
+        candidates = connection.execute(
+            "SELECT id, url FROM sites WHERE active = 1 AND COALESCE(next_due, 0) <= ? "
+            "AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY COALESCE(next_due, 0)",
+            (now, now),
+        ).fetchall()
+
+        leased = {}
+        for row in connection.execute("SELECT url FROM sites WHERE lease_expires >= ?", (now,)):
+            host = _host_key(row["url"])
+            leased[host] = leased.get(host, 0) + 1
+        next_allowed = {}
+        if rate > 0:
+            next_allowed = {row["host"]: row["next_allowed_at"] for row in connection.execute("SELECT * FROM hosts")}
+
+        site_ids = []
+        claimed_hosts = set()
+        for row in candidates:
+            if len(site_ids) >= limit:
+                break
+            host = _host_key(row["url"])
+            if max_per_host is not None and leased.get(host, 0) >= max_per_host:
+                continue
+            if rate > 0:
+                allowed_at = next_allowed.get(host)
+                if allowed_at is not None and allowed_at > now:
+                    continue
+                # A full bucket allows `burst` claims right away, then one every 1/rate seconds
+                next_allowed[host] = max(allowed_at or 0, now - (burst - 1) / rate) + 1 / rate
+                claimed_hosts.add(host)
+            leased[host] = leased.get(host, 0) + 1
+            site_ids.append(row["id"])
+
+        connection.executemany(
+            "INSERT INTO hosts (host, next_allowed_at) VALUES (?, ?) "
+            "ON CONFLICT(host) DO UPDATE SET next_allowed_at = excluded.next_allowed_at",
+            [(host, next_allowed[host]) for host in claimed_hosts],
+        )
+        connection.executemany(
+            "UPDATE sites SET lease_owner = ?, lease_expires = ?, lease_token = COALESCE(lease_token, 0) + 1 WHERE id = ?",
+            [(owner, now + lease_seconds, site_id) for site_id in site_ids],
+        )
+        sites = []
+        for site_id in site_ids:
+            row = connection.execute(f"SELECT {SITE_FIELDS} FROM sites WHERE id = ?", (site_id,)).fetchone()
+            sites.append(_load_check_state(connection, _row_to_site(row)))
+    return sites
+
+# Write back a leased website with its check result, and schedule its next check.
+# Returns False, writing nothing, when the lease was lost in the meantime.
+def complete_leased_site(site, result, owner, next_due):
+    with _transaction() as connection:
+        if not _release_lease(connection, site, owner, next_due):
+            return False
+        # Only the check state is written, like for unleased sites
+        if _update_site(connection, site):
+            _save_rooms(connection, site)
+            _save_seen_listings(connection, site)
+            _save_fingerprint(connection, site)
+            _record_check(connection, result)
+            _prune_check_results(connection, [site["id"]])
+    return True
+
+# Give up leases, e.g. when a worker shuts down with claimed sites left unchecked
+def release_leases(owner):
+    with _transaction(bump_version=False) as connection:
+        connection.execute("UPDATE sites SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ?", (owner,))
+
+# Seconds until the next active website can be claimed, or None without active websites
+def next_due_in():
+    row = _connect().execute(
+        "SELECT MIN(MAX(COALESCE(next_due, 0), COALESCE(lease_expires, 0))) FROM sites WHERE active = 1"
+    ).fetchone()
+    return None if row[0] is None else max(0, row[0] - time.time())
+
+# Status of the latest check of every website that has been checked, by site ID
+def read_latest_check_statuses():
+    rows = _connect().execute(
+        "SELECT site_id, status FROM check_results WHERE id IN (SELECT MAX(id) FROM check_results GROUP BY site_id)"
+    )
+    return {row["site_id"]: row["status"] for row in rows}
+
+# Counter that changes whenever the stored websites change, also across processes
+def store_version():
+    return _connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
@@ -0,0 +1,95 @@
+import codecs
+import hashlib
+import os
+import time
+from importlib.util import find_spec
+
+from metrics import current_check
+
+# Streamed response bodies are read in chunks of this size and refused beyond MAX_BODY_BYTES
+STREAM_CHUNK_SIZE = 16 * 1024
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+
+# Content hash used for change detection. "auto" uses xxh3_128 when the xxhash
+# package is installed and blake2b otherwise; any hashlib name works as well.
+HASH_ALGORITHM = os.getenv("HASH_ALGORITHM", "auto")
+
+
+class BodyTooLargeError(Exception):
+    pass
+
+
+def _resolve_hash_algorithm():
+    if HASH_ALGORITHM != "auto":
+        return HASH_ALGORITHM
+    return "xxh3_128" if find_spec("xxhash") is not None else "blake2b"
+
+# Name stored next to each site's current_hash, so a change of algorithm is
+# recognised and re-baselined instead of being reported as a page change
+HASH_NAME = _resolve_hash_algorithm()
+
+def new_hasher():
+    if HASH_NAME == "xxh3_128":
+        import xxhash
+        return xxhash.xxh3_128()
+    if HASH_NAME == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.new(HASH_NAME)
+
+def hash_text(text):
+    hasher = new_hasher()
+    hasher.update(text.encode())
+    return hasher.hexdigest()
+
+# Yield the raw body of a streamed response chunk by chunk, enforcing MAX_BODY_BYTES.
+# The response is closed once the caller stops iterating.
+# Time spent waiting for chunks counts as the check's download phase.
+def iter_body(response):
+    size = 0
+    timer = current_check()
+    chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            timer.add("download", time.perf_counter() - started)
+            if chunk is None:
+                break
+            size += len(chunk)
+            timer.bytes += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise BodyTooLargeError(f"Response body exceeds {MAX_BODY_BYTES} bytes")
+            yield chunk
+    finally:
+        response.close()
+
+# Incremental decoder for the response's declared encoding
+def body_decoder(response):
+    try:
+        return codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+# Hash a streamed body without ever holding more than one chunk of it.
+# Each of the consumers sees every chunk as well.
+def hash_response(response, consumers=()):
+    hasher = new_hasher()
+    timer = current_check()
+    for chunk in iter_body(response):
+        started = time.perf_counter()
+        hasher.update(chunk)
+        for consume in consumers:
+            consume(chunk)
+        timer.add("hash", time.perf_counter() - started)
+    return hasher.hexdigest()
+
+# Read and decode a streamed body
+def read_text(response):
+    decoder = body_decoder(response)
+    timer = current_check()
+    parts = []
+    for chunk in iter_body(response):
+        with timer.phase("decode"):
+            parts.append(decoder.decode(chunk))
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
@@ -0,0 +1,77 @@
+import pytest
+
+import extractor
+
+
+# Fixture pages with the room IDs the original regex and BeautifulSoup extraction produced for them.
+# IDs feed the seen-listing index, so any change here makes every stored room look new.
+LISTING_PAGE = """<html><body><h1>Wohnungsangebote</h1><ul>
+<li class="angebot-item"><h2>Zimmer in der Emil-Figge-Straße 42</h2><p>Warmmiete 310 €, frei ab 01.11.</p></li>
+<li class="angebot-item"><h2>Apartment Vogelpothsweg 85</h2><p>Warmmiete 365 €, frei ab 01.12.</p></li>
+<li class="angebot-item"><h2>Doppelapartment Meitnerweg 4</h2><p>Warmmiete 420 €, frei ab 15.11.</p></li>
+<li class="angebot-item"><h2>Zimmer in der Emil-Figge-Straße 42</h2><p>Warmmiete 310 €, frei ab 01.11.</p></li>
+<li class="angebot-item"><h2>Einzelapartment Hauert 12</h2><p>Warmmiete 298 €, frei ab 01.01.</p></li>
+<li class="angebot-item"><h2>Zimmer Baroper Straße 331</h2><p>Warmmiete 275 €, frei ab sofort</p></li>
+<li class="angebot-item">Kurz</li>
+</ul></body></html>"""
+
+PRICE_PAGE = """<html><body><div class="content">
+<div class="room-box"><p>Apartment am Campus Süd, 21 m², 340 € warm</p></div>
+<p>Zimmer in WG Hainallee 8, 18 m², 295 € inklusive Nebenkosten</p>
+<p>Kaution: 500 €</p>
+<span>Wohnung Stockumer Straße 190, 2 Zimmer, 540 EUR warm</span>
+</div></body></html>"""
+
+LINK_PAGE = """<html><body><nav>
+<a href="/wohnen/wohnung/1201">Apartment Vogelpothsweg 85</a>
+<a href="/wohnen/zimmer/877">Zimmer Baroper Straße 331</a>
+<a href="/wohnen/angebot/15">Angebot</a>
+<a href="/kontakt">Kontakt und Beratung</a>
+</nav></body></html>"""
+
+FALLBACK_PAGE = """Aktuelle Angebote
+Wohnung Emil-Figge-Straße 42, 2 Zimmer, 52 m², 610 € warm
+Zimmer Vogelpothsweg 85, 14 m², 290 € warm
+Angebot gültig bis 30.11., Miete 330 €
+Wohnung"""
+
+
+SOUP_ROOM_IDS = {
+    "listing": ["0e67ccc3bf6e", "53544c8b2d32", "4df01e69970d", "593c6b9cd4a7", "443d837b1da1"],
+    "price": ["3b697145e577", "60f398fe245e", "ac53c0558c14"],
+    "link": ["cb6014508eb8", "202022687768"],
+    "fallback": ["eaa4aad22e41"],
+}
+
+FALLBACK_ROOM_IDS = {
+    "listing": [
+        "422777bdb331", "89e8ed242fdc", "55c9af8c6f0c", "b72bb03b8c26", "a56a47a0154d",
+        "b2c684186e50", "9e673372c2aa", "30172937a84d", "1387f389f7af",
+    ],
+    "price": ["867e346ec6f5"],
+    "link": [],
+    "fallback": ["22a01c124254", "b82bc1c18c65", "9bf3c618f081", "c3bc5c23cc16", "30fba03fddd7"],
+}
+
+PAGES = {
+    "listing": LISTING_PAGE,
+    "price": PRICE_PAGE,
+    "link": LINK_PAGE,
+    "fallback": FALLBACK_PAGE,
+}
+
+
+@pytest.mark.parametrize("page", sorted(PAGES))
+def test_soup_room_ids(monkeypatch, page):
+    pytest.importorskip("bs4")
+    monkeypatch.setattr(extractor, "BEAUTIFUL_SOUP_AVAILABLE", True)
+    monkeypatch.setattr(extractor, "PARSER", "html.parser")
+    rooms = extractor.extract_stwdo_rooms(PAGES[page])
+    assert [room["id"] for room in rooms] == SOUP_ROOM_IDS[page]
+
+
+@pytest.mark.parametrize("page", sorted(PAGES))
+def test_fallback_room_ids(monkeypatch, page):
+    monkeypatch.setattr(extractor, "BEAUTIFUL_SOUP_AVAILABLE", False)
+    rooms = extractor.extract_stwdo_rooms(PAGES[page])
+    assert [room["id"] for room in rooms] == FALLBACK_ROOM_IDS[page]
@@ -0,0 +1,111 @@
+import http.server
+import socketserver
+import smtplib
+import threading
+import urllib.parse
+
+import pytest
+
+import notifier
+
+
+# A minimal SMTP stand-in that advertises AUTH and records every command it receives
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b"220 localhost ESMTP\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(" ")[0].upper()
+            self.server.commands.append(verb)
+            if verb == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250 AUTH PLAIN\r\n")
+            elif verb == "AUTH":
+                self.wfile.write(b"235 Authentication successful\r\n")
+            elif verb == "DATA":
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                self.wfile.write(b"250 OK\r\n")
+            elif verb == "QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SMTPHandler)
+    server.daemon_threads = True
+    server.commands = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(notifier, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(notifier, "SMTP_PORT", server.server_address[1])
+    monkeypatch.setattr(notifier, "EMAIL_SENDER", "sender@example.com")
+    monkeypatch.setattr(notifier, "EMAIL_PASSWORD", "secret")
+    monkeypatch.setattr(notifier, "EMAIL_RECEIVER", "receiver@example.com")
+    monkeypatch.setattr(notifier, "NOTIFY_BATCH_WINDOW", 0)
+    monkeypatch.setattr(notifier, "NOTIFY_MAX_RETRIES", 0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("use_ssl", [True, False])
+def test_outbox_authenticates_before_sending(smtp_server, monkeypatch, use_ssl):
+    monkeypatch.setattr(notifier, "SMTP_USE_SSL", use_ssl)
+    # The stand-in speaks plain SMTP, keep the SSL code path but skip the TLS handshake
+    monkeypatch.setattr(smtplib, "SMTP_SSL", smtplib.SMTP)
+
+    outbox = notifier.NotificationOutbox()
+    assert outbox.enqueue("https://example.com", "Example", "changed", enable_telegram=False)
+    outbox.flush()
+    outbox._close_smtp()
+
+    commands = smtp_server.commands
+    assert "AUTH" in commands
+    assert commands.index("EHLO") < commands.index("AUTH") < commands.index("MAIL")
+    assert "DATA" in commands
+
+
+# A Telegram API stand-in that fails the second message once and records the delivered ones
+class _TelegramHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        fields = urllib.parse.parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        self.server.requests += 1
+        status = 500 if self.server.requests == 2 else 200
+        if status == 200:
+            self.server.texts.append(fields["text"][0])
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+
+def test_telegram_retry_skips_delivered_messages(monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _TelegramHandler)
+    server.requests = 0
+    server.texts = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(notifier, "TELEGRAM_API_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(notifier, "TELEGRAM_TOKEN", "token")
+    monkeypatch.setattr(notifier, "TELEGRAM_CHAT_ID", "chat")
+    monkeypatch.setattr(notifier, "NOTIFY_BATCH_WINDOW", 1)
+    monkeypatch.setattr(notifier, "NOTIFY_RETRY_DELAY", 0)
+
+    # Two notifications too long to share one message
+    outbox = notifier.NotificationOutbox()
+    for name in ("First", "Second"):
+        outbox.enqueue("https://example.com", name, "x" * 3000, enable_email=False)
+    outbox.flush()
+    server.shutdown()
+    server.server_close()
+
+    assert server.requests == 3
+    assert ["First" in text for text in server.texts] == [True, False]
@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import store
+from adaptive import next_check_interval
+from checker import HOST_BURST, HOST_RATE_LIMIT, MAX_CHECKS_PER_HOST, MAX_CONCURRENT_CHECKS, dispatch_check, run_check
+from metrics import serve_metrics, timed
+from notifier import get_outbox
+from profiling import profile_cycle
+from scheduler import jittered_interval
+
+# Lease-based workers. Any number of worker processes, on one machine or on
+# several sharing the store, claim due websites with a time-limited lease,
+# check them and write them back together with their next due time. A site
+# whose worker died is claimed again once the lease expired; the write-back
+# is fenced by the lease token, so a worker that lost its lease can't
+# overwrite a newer result. The per-host request rate and concurrency limits
+# are enforced when claiming, across all workers sharing the store. Back-off
+# requests of a host (429, Retry-After) are still learned per process.
+WORKER_LEASE_SECONDS = float(os.getenv("WORKER_LEASE_SECONDS", "120"))
+# Longest wait between looking for due websites
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+
+
+class LeaseWorker:
+    def __init__(self, max_workers=MAX_CONCURRENT_CHECKS, on_result=None, owner=None):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.max_workers = max_workers
+        self._on_result = on_result  # Called with every stored check result
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    # Claim and check due websites until stop() is called
+    def run(self, **options):
+        try:
+            while True:
+                with self._condition:
+                    if self._stopped:
+                        break
+                    free = self.max_workers - self._in_flight
+                    if free <= 0:
+                        self._condition.wait()  # Until a check completes
+                        continue
+
+                sites = store.claim_due_sites(self.owner, free, WORKER_LEASE_SECONDS,
+                                              MAX_CHECKS_PER_HOST, HOST_RATE_LIMIT, HOST_BURST)
+                with self._condition:
+                    self._in_flight += len(sites)
+                for site in sites:
+                    dispatch_check(self._executor, site["url"], partial(self._check, site, options))
+
+                if not sites:
+                    wait = store.next_due_in()
+                    wait = WORKER_POLL_SECONDS if wait is None else min(wait, WORKER_POLL_SECONDS)
+                    if wait <= 0:
+                        # Due sites left unclaimed wait for their host's budget, which
+                        # frees up with the rate limit or with checks completing
+                        wait = min(1 / HOST_RATE_LIMIT if HOST_RATE_LIMIT > 0 else WORKER_POLL_SECONDS, WORKER_POLL_SECONDS)
+                    with self._condition:
+                        if not self._stopped:
+                            self._condition.wait(max(wait, 0.05))
+        finally:
+            self._executor.shutdown(wait=True)
+            store.release_leases(self.owner)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _check(self, site, options, throttle_wait=None):
+        started = time.time()
+        try:
+            with profile_cycle("check", site["id"]):
+                result = run_check(site, throttle_wait, **options)
+                next_due = started + jittered_interval(next_check_interval(site))
+                with timed("persist", site["id"]):
+                    stored = store.complete_leased_site(site, result, self.owner, next_due)
+            if not stored:
+                print(f"Lease on {site['url']} was lost, result discarded")
+            elif self._on_result is not None:
+                self._on_result(result)
+        except Exception as e:
+            print(f"Error checking {site['id']}: {e}")
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+# Entry point of one worker process
+def _worker_process(options, max_workers, on_result, metrics_port):
+    if metrics_port:
+        serve_metrics(metrics_port)
+    worker = LeaseWorker(max_workers=max_workers, on_result=on_result)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run(**options)
+    get_outbox().flush()
+
+# Run `processes` worker processes with `max_workers` check threads each,
+# until interrupted. Parsing scales with the cores this way, not just I/O.
+# With a metrics_port, process i serves its metrics on metrics_port + i.
+def run_workers(processes, max_workers=MAX_CONCURRENT_CHECKS, on_result=None, metrics_port=None, **options):
+    context = multiprocessing.get_context("spawn")
+    children = [
+        context.Process(
+            target=_worker_process,
+            args=(options, max_workers, on_result, metrics_port + index if metrics_port else None),
+            name=f"worker-{index}",
+        )
+        for index in range(processes)
+    ]
+    for child in children:
+        child.start()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for child in children:
+            child.join()
+    except (KeyboardInterrupt, SystemExit):
+        for child in children:
+            if child.is_alive():
+                child.terminate()  # SIGTERM, the worker releases its leases and exits
+        for child in children:
+            child.join()